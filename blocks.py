@@ -7,6 +7,34 @@ import torch
 import torch.nn.functional as F
 from torch import nn
 
+from op import memory_format
+
+
+def instance_norm(x, weight=None, bias=None, eps=1e-5):
+    # per-(sample, channel) normalization with broadcasting only, so that a
+    # channels_last input stays channels_last; weight and bias are
+    # broadcastable to x
+    var, mean = torch.var_mean(x, [2, 3], unbiased=False, keepdim=True)
+    out = (x - mean) * torch.rsqrt(var + eps)
+    if weight is not None:
+        out = out * weight
+    if bias is not None:
+        out = out + bias
+    return out
+
+
+class InstanceNorm2d(nn.InstanceNorm2d):
+    # F.instance_norm folds the batch into channels, which turns a
+    # channels_last input into NCHW
+    def forward(self, x):
+        if memory_format(x) != torch.channels_last or self.track_running_stats:
+            return super(InstanceNorm2d, self).forward(x)
+        weight = bias = None
+        if self.affine:
+            weight = self.weight.view(1, -1, 1, 1)
+            bias = self.bias.view(1, -1, 1, 1)
+        return instance_norm(x, weight, bias, self.eps)
+
 
 class ResBlocks(nn.Module):
     def __init__(self, num_blocks, dim, norm, activation, pad_type):
@@ -130,7 +158,7 @@ class Conv2dBlock(nn.Module):
         if norm == 'bn':
             self.norm = nn.BatchNorm2d(norm_dim)
         elif norm == 'in':
-            self.norm = nn.InstanceNorm2d(norm_dim)
+            self.norm = InstanceNorm2d(norm_dim)
         elif norm == 'adain':
             self.norm = AdaptiveInstanceNorm2d(norm_dim)
         elif norm == 'none':
@@ -178,11 +206,23 @@ class AdaptiveInstanceNorm2d(nn.Module):
         self.bias = None
         self.register_buffer('running_mean', torch.zeros(num_features))
         self.register_buffer('running_var', torch.ones(num_features))
+        self.frozen = False
+
+    def freeze(self):
+        # the running statistics below are repeated per call, updated on the
+        # copies and dropped, so they never affect the output; frozen, forward
+        # skips them and normalizes directly
+        self.frozen = True
 
     def forward(self, x):
         assert self.weight is not None and \
                self.bias is not None, "Please assign AdaIN weight first"
         b, c = x.size(0), x.size(1)
+        if self.frozen or memory_format(x) == torch.channels_last:
+            # the running statistics below are updated on copies and dropped,
+            # so plain instance norm gives the same result
+            return instance_norm(x, self.weight.view(b, c, 1, 1),
+                                 self.bias.view(b, c, 1, 1), self.eps)
         running_mean = self.running_mean.repeat(b)
         running_var = self.running_var.repeat(b)
         x_reshaped = x.contiguous().view(1, b * c, *x.size()[2:])
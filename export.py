@@ -0,0 +1,234 @@
+# Static-graph export of a Generator for serving without Python:
+#
+#     python export.py --ckpt /path/to/model.pt --size 256 --format onnx --out generator.onnx
+#
+# The graph is traced for one fixed configuration: W or Z input, truncation psi
+# and mean latent baked in, one batch size, and the noise either taken from the
+# generator's noise buffers or passed in as inputs. Inside the trace the ops use
+# their native variants, so the graph only holds plain torch ops (see
+# op.registry.dispatch). After export, the graph is run on the example inputs and
+# compared with the eager model.
+import argparse
+import copy
+import inspect
+
+import torch
+from torch import nn
+
+from model import Generator, load_model, unwrap_state_dict
+
+
+class ExportedGenerator(nn.Module):
+    # Generator.forward for one configuration as a function of tensors only:
+    # forward(latent) with noise='buffers', forward(latent, noise_0, ...,
+    # noise_{num_layers - 1}) with noise='input'; returns the image
+    def __init__(self, generator, input='w', truncation=1, truncation_latent=None, noise='buffers'):
+        super().__init__()
+
+        if input not in ('w', 'z'):
+            raise ValueError(f"input must be 'w' or 'z', got {input!r}")
+
+        if noise not in ('buffers', 'input'):
+            raise ValueError(f"noise must be 'buffers' or 'input', got {noise!r}")
+
+        if truncation < 1 and truncation_latent is None:
+            raise ValueError('truncation < 1 needs the truncation_latent to bake in')
+
+        self.generator = generator
+        self.input = input
+        self.truncation = truncation
+        self.noise = noise
+
+        if truncation < 1:
+            self.register_buffer('truncation_latent', truncation_latent.detach().clone())
+
+        else:
+            self.truncation_latent = None
+
+    def forward(self, latent, *noise):
+        image, _ = self.generator(
+            [latent],
+            input_is_latent=self.input == 'w',
+            truncation=self.truncation,
+            truncation_latent=self.truncation_latent,
+            noise=list(noise) if self.noise == 'input' else None,
+            randomize_noise=False,
+        )
+
+        return image
+
+
+def example_inputs(generator, batch=1, noise='buffers'):
+    # a random latent, and with noise='input' the generator's noise buffers
+    # expanded to the batch
+    device = generator.input.input.device
+    inputs = [torch.randn(batch, generator.style_dim, device=device)]
+
+    if noise == 'input':
+        for i in range(generator.num_layers):
+            buffer = getattr(generator.noises, f'noise_{i}')
+            inputs.append(buffer.expand(batch, -1, -1, -1).contiguous())
+
+    return tuple(inputs)
+
+
+def psnr(image, reference, reduction='mean'):
+    # PSNR in dB of images in [-1, 1], so the peak to peak range is 2: of the
+    # whole batch with reduction='mean', of each sample ([batch]) with 'none'
+    error = (image.float() - reference.float()).pow(2)
+
+    if reduction == 'mean':
+        mse = error.mean()
+
+    elif reduction == 'none':
+        mse = error.flatten(1).mean(1)
+
+    else:
+        raise ValueError(f"reduction must be 'mean' or 'none', got {reduction!r}")
+
+    return 10 * torch.log10(4 / mse.clamp_min(1e-30))
+
+
+def parity(image, reference):
+    error = (image.float() - reference.float()).abs()
+
+    return {
+        'max_abs_error': error.max().item(),
+        'mean_abs_error': error.mean().item(),
+        'psnr': psnr(image, reference).item(),
+    }
+
+
+def export(
+    generator,
+    path,
+    format='torchscript',
+    input='w',
+    truncation=1,
+    truncation_latent=None,
+    noise='buffers',
+    batch=1,
+    opset_version=17,
+):
+    """Exports generator for one configuration (see ExportedGenerator) to path,
+    as a traced and frozen TorchScript module or as an ONNX model.
+
+    The exported copy is frozen for inference; generator itself is unchanged.
+    Returns the parity of the exported graph against the eager generator on
+    random example inputs: the maximum and mean absolute error and the PSNR.
+    The ONNX check needs onnxruntime and is skipped (None) without it.
+    """
+
+    frozen = copy.deepcopy(generator).freeze_for_inference()
+    module = ExportedGenerator(frozen, input, truncation, truncation_latent, noise).eval()
+    inputs = example_inputs(frozen, batch, noise)
+
+    with torch.no_grad():
+        reference = ExportedGenerator(
+            generator, input, truncation, truncation_latent, noise
+        ).eval()(*inputs)
+
+    input_names = ['latent'] + [f'noise_{i}' for i in range(len(inputs) - 1)]
+
+    if format == 'torchscript':
+        with torch.no_grad():
+            traced = torch.jit.freeze(torch.jit.trace(module, inputs, check_trace=False))
+
+        torch.jit.save(traced, path)
+
+        with torch.no_grad():
+            image = torch.jit.load(path, map_location=inputs[0].device)(*inputs)
+
+    elif format == 'onnx':
+        # the TorchScript-based exporter, which traces; newer torch defaults to
+        # the dynamo one
+        kwargs = {}
+
+        if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+            kwargs['dynamo'] = False
+
+        with torch.no_grad():
+            torch.onnx.export(
+                module,
+                inputs,
+                path,
+                input_names=input_names,
+                output_names=['image'],
+                opset_version=opset_version,
+                **kwargs,
+            )
+
+        try:
+            import onnxruntime
+
+        except ImportError:
+            return None
+
+        session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        feeds = {name: tensor.cpu().numpy() for name, tensor in zip(input_names, inputs)}
+        image = torch.from_numpy(session.run(None, feeds)[0])
+        reference = reference.cpu()
+
+    else:
+        raise ValueError(f"format must be 'torchscript' or 'onnx', got {format!r}")
+
+    return parity(image, reference)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--ckpt', type=str, required=True)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--key', type=str, default='g_ema', help='generator weights in the checkpoint')
+    parser.add_argument('--format', type=str, default='torchscript', choices=['torchscript', 'onnx'])
+    parser.add_argument('--input', type=str, default='w', choices=['w', 'z'])
+    parser.add_argument('--truncation', type=float, default=1)
+    parser.add_argument('--truncation_mean', type=int, default=4096)
+    parser.add_argument('--noise', type=str, default='buffers', choices=['buffers', 'input'])
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--out', type=str, required=True)
+
+    args = parser.parse_args()
+
+    checkpoint = torch.load(args.ckpt, map_location='cpu')
+    generator = load_model(
+        Generator,
+        unwrap_state_dict(checkpoint[args.key]),
+        args.size,
+        512,
+        8,
+        channel_multiplier=args.channel_multiplier,
+        device=args.device,
+        strict=False,
+    ).eval()
+
+    truncation_latent = None
+
+    if args.truncation < 1:
+        with torch.no_grad():
+            truncation_latent = generator.mean_latent(args.truncation_mean)
+
+    report = export(
+        generator,
+        args.out,
+        format=args.format,
+        input=args.input,
+        truncation=args.truncation,
+        truncation_latent=truncation_latent,
+        noise=args.noise,
+        batch=args.batch,
+        opset_version=args.opset,
+    )
+
+    if report is None:
+        print(f'{args.out}: saved, onnxruntime is not installed so parity was not checked')
+
+    else:
+        print(
+            f'{args.out}: max abs error {report["max_abs_error"]:.2e}, '
+            f'mean abs error {report["mean_abs_error"]:.2e}, PSNR {report["psnr"]:.1f} dB'
+        )
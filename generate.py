@@ -1,12 +1,93 @@
 import argparse
+import json
+import os
 import random
 import torch
 import torch.nn as nn
 from torchvision import utils
-from model import Generator
+from export import psnr
+from model import Generator, load_model, unwrap_state_dict
+from quantize import load_quantized
 from tqdm import tqdm
 import sys
 
+def load_generator(args, path, device):
+    # the checkpoint's g_ema, built straight from its tensors (see
+    # model.load_model); g_ema saved from a DataParallel has module. prefixes
+    checkpoint = torch.load(path, map_location='cpu')
+
+    return load_model(
+        Generator,
+        unwrap_state_dict(checkpoint['g_ema']),
+        args.size,
+        args.latent,
+        args.n_mlp,
+        channel_multiplier=args.channel_multiplier,
+        device=device,
+        strict=False,
+    )
+
+
+def autocast(args, device):
+    # --precision bf16 runs the generators under bfloat16 autocast; model.py keeps
+    # PixelNorm, the demodulation and the RGB skip in fp32
+    return torch.autocast(
+        torch.device(device).type,
+        dtype=torch.bfloat16,
+        enabled=args.precision == 'bf16',
+    )
+
+
+def precision_parity(args, g_list, device, mean_latent):
+    # PSNR and LPIPS of each generator's --precision samples against fp32 ones
+    # from the same latents and noise
+    import lpips
+
+    if not os.path.exists("test_sample"):
+        os.makedirs("test_sample")
+
+    percept = lpips.LPIPS(net='alex').to(device)
+    names = [name for name in ('source', 'target') if getattr(args, f'ckpt_{name}')]
+    report = {}
+
+    with torch.no_grad():
+        for name, g_test in zip(names, g_list):
+            g_test.eval()
+            sample_z = torch.randn(args.n_sample, args.latent, device=device)
+            kwargs = dict(
+                truncation=args.truncation,
+                truncation_latent=mean_latent,
+                randomize_noise=False,
+            )
+
+            reference, _ = g_test([sample_z], **kwargs)
+
+            with autocast(args, device):
+                sample, _ = g_test([sample_z], **kwargs)
+
+            sample = sample.float().clamp(-1, 1)
+            reference = reference.clamp(-1, 1)
+            scores = psnr(sample, reference, reduction='none')
+            distances = percept(sample, reference).flatten()
+
+            report[getattr(args, f'ckpt_{name}')] = {
+                'precision': args.precision,
+                'psnr': scores.mean().item(),
+                'psnr_min': scores.min().item(),
+                'lpips': distances.mean().item(),
+                'lpips_max': distances.max().item(),
+            }
+
+            print(
+                f'{name}: {args.precision} vs fp32, PSNR {scores.mean():.2f} dB '
+                f'(min {scores.min():.2f}), LPIPS {distances.mean():.4f} '
+                f'(max {distances.max():.4f})'
+            )
+
+    with open('test_sample/parity.json', 'w') as f:
+        json.dump(report, f, indent=1)
+
+
 def generate_gif(args, g_list, device, mean_latent):
     g_ema = g_list[0]
     if len(g_list) > 1:
@@ -33,12 +114,13 @@ def generate_gif(args, g_list, device, mean_latent):
             for i in range(n_steps):
                 alpha = step*i
                 z = z2*alpha + (1-alpha)*z1
-                sample, _ = g_ema([z], truncation=args.truncation,
-                                  truncation_latent=mean_latent, randomize_noise=False)
-                if len(g_list) > 1:
-                    sample2, _ = g_ema2(
-                        [z], truncation=args.truncation, truncation_latent=mean_latent, randomize_noise=False)
-                    sample = torch.cat((sample, sample2), dim=3)
+                with autocast(args, device):
+                    sample, _ = g_ema([z], truncation=args.truncation,
+                                      truncation_latent=mean_latent, randomize_noise=False)
+                    if len(g_list) > 1:
+                        sample2, _ = g_ema2(
+                            [z], truncation=args.truncation, truncation_latent=mean_latent, randomize_noise=False)
+                        sample = torch.cat((sample, sample2), dim=3)
 
                 utils.save_image(
                     sample,
@@ -51,6 +133,39 @@ def generate_gif(args, g_list, device, mean_latent):
 
 
 
+def generate_mixing(args, g_list, device, mean_latent):
+    # an n_mixing x n_mixing grid per generator: the rows share the coarse styles
+    # (latent rows before inject_index), the columns the fine ones
+    if not os.path.exists("test_sample"):
+        os.makedirs("test_sample")
+
+    with torch.no_grad():
+        coarse = torch.randn(args.n_mixing, args.latent, device=device)
+        fine = torch.randn(args.n_mixing, args.latent, device=device)
+
+        for i, g_test in enumerate(g_list):
+            g_test = getattr(g_test, 'module', g_test)
+            g_test.eval()
+
+            with autocast(args, device):
+                sample = g_test.style_mixing(
+                    coarse,
+                    fine,
+                    inject_index=args.inject_index,
+                    truncation=args.truncation,
+                    truncation_latent=mean_latent,
+                    randomize_noise=False,
+                )
+
+            utils.save_image(
+                sample.flatten(0, 1),
+                f'test_sample/mixing_{i}.png',
+                nrow=args.n_mixing,
+                normalize=True,
+                range=(-1, 1),
+            )
+
+
 def generate_imgs(args, g_list, device, mean_latent):
     if not os.path.exists("test_sample"):
         os.makedirs("test_sample")
@@ -64,7 +179,8 @@ def generate_imgs(args, g_list, device, mean_latent):
             else:
                 sample_z = torch.randn(args.n_sample, args.latent, device=device)
 
-            sample, _ = g_test([sample_z], truncation=args.truncation, truncation_latent=mean_latent, input_is_latent=False, randomize_noise=False)
+            with autocast(args, device):
+                sample, _ = g_test([sample_z], truncation=args.truncation, truncation_latent=mean_latent, input_is_latent=False, randomize_noise=False, max_resolution=args.max_resolution)
             if i == 0:
                 tot_img = sample
             else:
@@ -79,8 +195,6 @@ def generate_imgs(args, g_list, device, mean_latent):
          )
 
 if __name__ == '__main__':
-    device = 'cuda'
-
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--size', type=int, default=256)
@@ -93,9 +207,17 @@ if __name__ == '__main__':
     parser.add_argument('--mode', type=str, default='viz_imgs')
     parser.add_argument('--load_noise', type=str, default=None)
     parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--max_resolution', type=int, default=None, help='stop synthesis at this resolution (viz_imgs), for cheap previews')
+    parser.add_argument('--autotune', action='store_true', help='time the op variants on the generator shapes first and use the fastest')
+    parser.add_argument('--device', type=str, default='cuda')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16'], help='bf16 runs the generators under bfloat16 autocast; --mode parity compares it to fp32')
+    parser.add_argument('--n_mixing', type=int, default=5, help='rows and columns of the style_mixing grid')
+    parser.add_argument('--inject_index', type=int, default=4, help='first latent row taken from the fine styles (style_mixing)')
+    parser.add_argument('--int8', action='store_true', help='serve int8 quantized generators on the CPU, with the calibration saved next to each checkpoint by quantize.py')
     torch.manual_seed(10)
     random.seed(10)
     args = parser.parse_args()
+    device = args.device
 
     args.latent = 512
     args.n_mlp = 8
@@ -103,23 +225,21 @@ if __name__ == '__main__':
     g_list = []
     # loading source model if available
     if args.ckpt_source is not None:
-        g_source = Generator(
-            args.size, args.latent, args.n_mlp, channel_multiplier=args.channel_multiplier
-        ).to(device)
-        checkpoint = torch.load(args.ckpt_source)
-        g_source.load_state_dict(checkpoint['g_ema'], strict=False)
+        g_source = load_generator(args, args.ckpt_source, device)
+        if args.int8:
+            load_quantized(g_source, args.ckpt_source)
         g_list.append(g_source)
 
     # loading target model if available
     if args.ckpt_target is not None:
-        g_target = Generator(
-            args.size, args.latent, args.n_mlp, channel_multiplier=args.channel_multiplier
-        ).to(device)
-        g_target = nn.parallel.DataParallel(g_target)
-        checkpoint = torch.load(args.ckpt_target)
-        g_target.load_state_dict(checkpoint['g_ema'], strict=False)
+        g_target = nn.parallel.DataParallel(load_generator(args, args.ckpt_target, device))
+        if args.int8:
+            load_quantized(g_target.module, args.ckpt_target)
         g_list.append(g_target)
 
+    if args.autotune and g_list:
+        g_tune = getattr(g_list[0], 'module', g_list[0])
+        g_tune.autotune(batch=1 if args.mode == 'interpolate' else args.n_sample)
 
     if args.truncation < 1:
         with torch.no_grad():
@@ -130,4 +250,8 @@ if __name__ == '__main__':
         generate_imgs(args, g_list, device, mean_latent)
     elif args.mode == 'interpolate':
         generate_gif(args, g_list, device, mean_latent)
+    elif args.mode == 'style_mixing':
+        generate_mixing(args, g_list, device, mean_latent)
+    elif args.mode == 'parity':
+        precision_parity(args, g_list, device, mean_latent)
 
@@ -1,3 +1,4 @@
+import copy
 import math
 import random
 import functools
@@ -8,8 +9,17 @@ from torch import nn
 from torch.nn import functional as F
 from torch.nn import Upsample as inbuilt_upsample
 from torch.autograd import Function
+from torch.func import functional_call
 import numpy as np
-from op import FusedLeakyReLU, fused_leaky_relu, upfirdn2d
+from op import (
+    FusedLeakyReLU,
+    autotune,
+    fused_leaky_relu,
+    fused_noise_leaky_relu,
+    fused_noise_leaky_relu_,
+    memory_format,
+    upfirdn2d,
+)
 from torch.nn import init
 from packaging import version
 from blocks import LinearBlock, Conv2dBlock, ResBlocks, ActFirstResBlock
@@ -19,7 +29,10 @@ class PixelNorm(nn.Module):
         super().__init__()
 
     def forward(self, input):
-        return input * torch.rsqrt(torch.mean(input ** 2, dim=1, keepdim=True) + 1e-8)
+        # the mean of squares is taken in fp32 for low precision inputs
+        norm = torch.rsqrt(torch.mean(input.float() ** 2, dim=1, keepdim=True) + 1e-8)
+
+        return input * norm.to(input.dtype)
 
 
 def make_kernel(k):
@@ -33,11 +46,96 @@ def make_kernel(k):
     return k
 
 
+def make_kernel_1d(k, gain=1):
+    # 1-D factor of make_kernel(k), or None if k is already 2-D. It is a
+    # non-persistent buffer that checkpoints don't hold, so it is built on the
+    # CPU even when load_model constructs the module on the meta device.
+    k = torch.tensor(k, dtype=torch.float32, device='cpu')
+
+    if k.ndim != 1:
+        return None
+
+    return k / k.sum() * gain
+
+
+def bake_parameter(module, name, value):
+    # replaces the parameter name of module by a constant buffer holding value
+    delattr(module, name)
+    module.register_buffer(name, value.detach().clone())
+
+
+def load_model(cls, state_dict, *args, device='cpu', strict=True, **kwargs):
+    # cls(*args, **kwargs) holding the weights of state_dict, without the random
+    # initialisation that loading would overwrite: the modules are built on the
+    # meta device and the checkpoint tensors, moved to device, become their
+    # parameters and buffers. With strict=False, whatever the checkpoint lacks is
+    # taken from a normally initialised instance.
+    with torch.device('meta'):
+        model = cls(*args, **kwargs)
+
+    state_dict = {key: value.to(device) for key, value in state_dict.items()}
+    model.load_state_dict(state_dict, strict=strict, assign=True)
+
+    tensors = dict(model.named_parameters())
+    tensors.update(model.named_buffers())
+    missing = [name for name, tensor in tensors.items() if tensor.is_meta]
+
+    if missing:
+        initialised = cls(*args, **kwargs)
+        initialised = dict(initialised.state_dict())
+        model.load_state_dict(
+            {name: initialised[name].to(device) for name in missing}, strict=False, assign=True
+        )
+
+    model = model.to(device)
+
+    # the checkpoint tensors come in whatever layout they were saved in
+    if getattr(model, 'memory_format', None) is not None:
+        convert_memory_format(model, model.memory_format)
+
+    return model
+
+
+def unwrap_state_dict(state_dict):
+    # state_dict without the module. prefixes a DataParallel or
+    # DistributedDataParallel wrapper puts on the keys when it is saved
+    return {
+        key[len('module.'):] if key.startswith('module.') else key: value
+        for key, value in state_dict.items()
+    }
+
+
+def freeze_for_inference(model):
+    # Folds the equalized learning rate scales and other per-call constants of
+    # every layer into stored tensors (see the freeze methods), switches to eval
+    # and turns off gradients. The frozen state_dict holds the folded values, so
+    # keep the unfrozen model around for training and checkpoints.
+    model.eval()
+    model.requires_grad_(False)
+
+    for module in model.modules():
+        if module is not model and hasattr(module, 'freeze'):
+            module.freeze()
+
+    return model
+
+
+def convert_memory_format(model, memory_format):
+    # Module.to(memory_format=...) would also try the 5-D modulated conv weights,
+    # which channels_last can't hold, so only the 4-D tensors are converted here
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        if tensor.dim() == 4:
+            tensor.data = tensor.data.contiguous(memory_format=memory_format)
+
+    return model
+
+
 class Upsample(nn.Module):
     def __init__(self, kernel, factor=2):
         super().__init__()
 
         self.factor = factor
+        self.register_buffer('kernel_1d', make_kernel_1d(kernel, factor), persistent=False)
         kernel = make_kernel(kernel) * (factor ** 2)
         self.register_buffer('kernel', kernel)
 
@@ -47,9 +145,18 @@ class Upsample(nn.Module):
         pad1 = p // 2
 
         self.pad = (pad0, pad1)
+        self.plans = {}
 
     def forward(self, input):
-        out = upfirdn2d(input, self.kernel, up=self.factor, down=1, pad=self.pad)
+        out = upfirdn2d(
+            input,
+            self.kernel,
+            up=self.factor,
+            down=1,
+            pad=self.pad,
+            kernel_1d=self.kernel_1d,
+            plans=self.plans,
+        )
 
         return out
 def assign_adain_params(adain_params, model):
@@ -77,6 +184,7 @@ class Downsample(nn.Module):
         super().__init__()
 
         self.factor = factor
+        self.register_buffer('kernel_1d', make_kernel_1d(kernel), persistent=False)
         kernel = make_kernel(kernel)
         self.register_buffer('kernel', kernel)
 
@@ -86,9 +194,18 @@ class Downsample(nn.Module):
         pad1 = p // 2
 
         self.pad = (pad0, pad1)
+        self.plans = {}
 
     def forward(self, input):
-        out = upfirdn2d(input, self.kernel, up=1, down=self.factor, pad=self.pad)
+        out = upfirdn2d(
+            input,
+            self.kernel,
+            up=1,
+            down=self.factor,
+            pad=self.pad,
+            kernel_1d=self.kernel_1d,
+            plans=self.plans,
+        )
 
         return out
 
@@ -97,6 +214,9 @@ class Blur(nn.Module):
     def __init__(self, kernel, pad, upsample_factor=1):
         super().__init__()
 
+        self.register_buffer(
+            'kernel_1d', make_kernel_1d(kernel, upsample_factor), persistent=False
+        )
         kernel = make_kernel(kernel)
 
         if upsample_factor > 1:
@@ -105,9 +225,12 @@ class Blur(nn.Module):
         self.register_buffer('kernel', kernel)
 
         self.pad = pad
+        self.plans = {}
 
     def forward(self, input):
-        out = upfirdn2d(input, self.kernel, pad=self.pad)
+        out = upfirdn2d(
+            input, self.kernel, pad=self.pad, kernel_1d=self.kernel_1d, plans=self.plans
+        )
 
         return out
 
@@ -132,10 +255,24 @@ class EqualConv2d(nn.Module):
         else:
             self.bias = None
 
+        self.frozen = False
+
+    def freeze(self):
+        if not self.frozen:
+            bake_parameter(self, 'weight', self.weight * self.scale)
+            self.scale = 1
+            self.frozen = True
+
+    def scaled_weight(self):
+        if self.frozen:
+            return self.weight
+
+        return self.weight * self.scale
+
     def forward(self, input):
         out = F.conv2d(
             input,
-            self.weight * self.scale,
+            self.scaled_weight(),
             bias=self.bias,
             stride=self.stride,
             padding=self.padding,
@@ -168,16 +305,32 @@ class EqualLinear(nn.Module):
 
         self.scale = (1 / math.sqrt(in_dim)) * lr_mul
         self.lr_mul = lr_mul
+        self.frozen = False
+
+    def freeze(self):
+        if not self.frozen:
+            bake_parameter(self, 'weight', self.weight * self.scale)
+
+            if self.bias is not None:
+                bake_parameter(self, 'bias', self.bias * self.lr_mul)
+
+            self.scale = 1
+            self.lr_mul = 1
+            self.frozen = True
 
     def forward(self, input):
+        if self.frozen:
+            weight, bias = self.weight, self.bias
+
+        else:
+            weight, bias = self.weight * self.scale, self.bias * self.lr_mul
+
         if self.activation:
-            out = F.linear(input, self.weight * self.scale)
-            out = fused_leaky_relu(out, self.bias * self.lr_mul)
+            out = F.linear(input, weight)
+            out = fused_leaky_relu(out, bias)
 
         else:
-            out = F.linear(
-                input, self.weight * self.scale, bias=self.bias * self.lr_mul
-            )
+            out = F.linear(input, weight, bias=bias)
 
         return out
 
@@ -210,6 +363,8 @@ class ModulatedConv2d(nn.Module):
         upsample=False,
         downsample=False,
         blur_kernel=[1, 3, 3, 1],
+        fused_upsample=False,
+        modulation='auto',
     ):
         super().__init__()
 
@@ -219,6 +374,7 @@ class ModulatedConv2d(nn.Module):
         self.out_channel = out_channel
         self.upsample = upsample
         self.downsample = downsample
+        self.fused_upsample = False
 
         if upsample:
             factor = 2
@@ -228,6 +384,11 @@ class ModulatedConv2d(nn.Module):
 
             self.blur = Blur(blur_kernel, pad=(pad0, pad1), upsample_factor=factor)
 
+            # the blur can only be folded into the transposed conv when it pads
+            # both sides equally
+            self.fused_upsample = fused_upsample and pad0 == pad1
+            self.fused_padding = len(blur_kernel) - 1 - pad0
+
         if downsample:
             factor = 2
             p = (len(blur_kernel) - factor) + (kernel_size - 1)
@@ -248,17 +409,40 @@ class ModulatedConv2d(nn.Module):
 
         self.demodulate = demodulate
 
+        # 'grouped' modulates the weight per sample and runs one grouped conv,
+        # 'input' scales the activations around one shared-weight conv, 'auto'
+        # picks per call, see use_input_scaling
+        self.modulation_mode = modulation
+        self.frozen = False
+
     def __repr__(self):
         return (
             f'{self.__class__.__name__}({self.in_channel}, {self.out_channel}, {self.kernel_size}, '
             f'upsample={self.upsample}, downsample={self.downsample})'
         )
 
-    def forward(self, input, style):
+    def forward(self, input, style, modulated=False):
+        # modulated: style is already self.modulation(style), see Generator.layer_styles
         batch, in_channel, height, width = input.shape
 
-        style = self.modulation(style).view(batch, 1, in_channel, 1, 1)
-        weight = self.scale * self.weight * style
+        if not modulated:
+            style = self.modulation(style)
+
+        style = style.view(batch, 1, in_channel, 1, 1)
+
+        if self.use_input_scaling(input):
+            return self.forward_input_scaling(input, style)
+
+        if self.fused_upsample:
+            return self.forward_fused_upsample(input, style)
+
+        return self.forward_grouped(input, style, self.scaled_weight())
+
+    def forward_grouped(self, input, style, weight):
+        # one grouped conv with the per-sample weights weight * style, for scaled
+        # weights of [1 or batch, out, in, k, k] and [batch, 1, in, 1, 1] styles
+        batch, in_channel, height, width = input.shape
+        weight = weight * style
 
         if self.demodulate:
             demod = torch.rsqrt(weight.pow(2).sum([2, 3, 4]) + 1e-8)
@@ -269,7 +453,7 @@ class ModulatedConv2d(nn.Module):
         )
 
         if self.upsample:
-            input = input.view(1, batch * in_channel, height, width)
+            input = input.reshape(1, batch * in_channel, height, width)
             weight = weight.view(
                 batch, self.out_channel, in_channel, self.kernel_size, self.kernel_size
             )
@@ -284,19 +468,166 @@ class ModulatedConv2d(nn.Module):
         elif self.downsample:
             input = self.blur(input)
             _, _, height, width = input.shape
-            input = input.view(1, batch * in_channel, height, width)
+            input = input.reshape(1, batch * in_channel, height, width)
             out = F.conv2d(input, weight, padding=0, stride=2, groups=batch)
             _, _, height, width = out.shape
             out = out.view(batch, self.out_channel, height, width)
 
         else:
-            input = input.view(1, batch * in_channel, height, width)
+            input = input.reshape(1, batch * in_channel, height, width)
             out = F.conv2d(input, weight, padding=self.padding, groups=batch)
             _, _, height, width = out.shape
             out = out.view(batch, self.out_channel, height, width)
 
         return out
 
+    def use_input_scaling(self, input):
+        if self.modulation_mode != 'auto':
+            return self.modulation_mode == 'input'
+
+        batch, _, height, width = input.shape
+
+        # the grouped conv reshapes the batch into channels, which needs NCHW
+        if memory_format(input) == torch.channels_last:
+            return True
+
+        # training keeps the original grouped modulation
+        if torch.is_grad_enabled():
+            return False
+
+        # a single sample is a plain conv either way
+        if batch == 1:
+            return False
+
+        # per sample, grouped builds [out, in, k, k] weights and input scaling
+        # scales [in, height, width] activations; the weights are the bigger
+        # tensor at low resolution
+        return self.out_channel * self.kernel_size ** 2 >= height * width
+
+    def forward_input_scaling(self, input, style):
+        # conv(x, w * style) == conv(x * style, w), and demodulation scales whole
+        # output channels, so it is applied to the conv output instead. The squared
+        # norm of each modulated kernel is style ** 2 @ sum_k((scale * w) ** 2),
+        # which needs no per-sample weight.
+        batch, in_channel, height, width = input.shape
+        style = style.view(batch, in_channel, 1, 1)
+        weight = self.scaled_weight().squeeze(0)
+
+        input = input * style
+
+        if self.upsample:
+            if self.fused_upsample:
+                out = F.conv_transpose2d(
+                    input,
+                    self.blurred_weight().transpose(0, 1),
+                    padding=self.fused_padding,
+                    stride=2,
+                )
+
+            else:
+                out = F.conv_transpose2d(input, weight.transpose(0, 1), padding=0, stride=2)
+                out = self.blur(out)
+
+        elif self.downsample:
+            input = self.blur(input)
+            out = F.conv2d(input, weight, padding=0, stride=2)
+
+        else:
+            out = F.conv2d(input, weight, padding=self.padding)
+
+        if self.demodulate:
+            demod = self.demodulation(style).to(out.dtype)
+            out = out * demod.view(batch, self.out_channel, 1, 1)
+
+        return out
+
+    def freeze(self):
+        # bakes self.scale into the weight and precomputes what forward derives
+        # from the weight alone: the blurred weight and the demodulation norms
+        if self.frozen:
+            return
+
+        bake_parameter(self, 'weight', self.scaled_weight())
+        self.scale = 1
+
+        weight_norm = self.weight_norm()
+        blurred = self.blurred_weight() if self.fused_upsample else None
+
+        self.frozen = True
+        self.register_buffer('weight_norm_frozen', weight_norm.detach())
+
+        if blurred is not None:
+            self.register_buffer('blurred_weight_frozen', blurred.detach())
+
+    def scaled_weight(self):
+        if self.frozen:
+            return self.weight
+
+        return self.scale * self.weight
+
+    def weight_norm(self):
+        # [out, in] sum over the kernel of the squared scaled weight
+        if self.frozen:
+            return self.weight_norm_frozen
+
+        return self.scaled_weight().squeeze(0).pow(2).sum([2, 3])
+
+    def demodulation(self, style):
+        # [batch, out] fp32 demodulation factors for [batch, ..., in, ...] styles;
+        # under autocast the matmul would otherwise run in low precision, where
+        # the 1e-8 is lost
+        batch = style.shape[0]
+        style = style.reshape(batch, self.in_channel).float()
+
+        with torch.autocast(style.device.type, enabled=False):
+            norm = style.pow(2) @ self.weight_norm().float().t()
+
+        return torch.rsqrt(norm + 1e-8)
+
+    def blurred_weight(self):
+        # the scaled [out, in, k + blur - 1, k + blur - 1] weight with the
+        # upsampling blur folded in, see forward_fused_upsample
+        if self.frozen:
+            return self.blurred_weight_frozen
+
+        pad = self.blur.kernel.shape[0] - 1
+        kernel_size = self.kernel_size + pad
+
+        weight = upfirdn2d(
+            self.scaled_weight().view(-1, 1, self.kernel_size, self.kernel_size),
+            self.blur.kernel,
+            pad=(pad, pad),
+            kernel_1d=self.blur.kernel_1d,
+        )
+
+        return weight.view(self.out_channel, self.in_channel, kernel_size, kernel_size)
+
+    def forward_fused_upsample(self, input, style):
+        # blur(conv_transpose(x, w)) == conv_transpose(x, w * blur), and modulation
+        # only rescales whole (out, in) kernels, so the blur is folded into the
+        # shared weight once per call. Demodulation uses the norm of the unblurred
+        # weight, as in the unfused path.
+        batch, in_channel, height, width = input.shape
+        weight = self.blurred_weight()
+        kernel_size = weight.shape[-1]
+        weight = weight.unsqueeze(0) * style
+
+        if self.demodulate:
+            demod = self.demodulation(style)
+            weight = weight * demod.view(batch, self.out_channel, 1, 1, 1)
+
+        input = input.reshape(1, batch * in_channel, height, width)
+        weight = weight.transpose(1, 2).reshape(
+            batch * in_channel, self.out_channel, kernel_size, kernel_size
+        )
+        out = F.conv_transpose2d(
+            input, weight, padding=self.fused_padding, stride=2, groups=batch
+        )
+        _, _, height, width = out.shape
+        out = out.view(batch, self.out_channel, height, width)
+
+        return out
+
 
 class NoiseInjection(nn.Module):
     def __init__(self):
@@ -317,10 +648,22 @@ class ConstantInput(nn.Module):
         super().__init__()
 
         self.input = nn.Parameter(torch.randn(1, channel, size, size))
+        self.frozen = False
+
+    def freeze(self):
+        # nothing writes to the constant in place, so a view of it will do
+        self.frozen = True
 
     def forward(self, input):
         batch = input.shape[0]
-        out = self.input.repeat(batch, 1, 1, 1)
+
+        # a broadcast view has no channels_last layout, so that still copies
+        if self.frozen and memory_format(self.input) != torch.channels_last:
+            return self.input.expand(batch, -1, -1, -1)
+
+        out = self.input.expand(batch, -1, -1, -1).contiguous(
+            memory_format=memory_format(self.input)
+        )
 
         return out
 
@@ -335,6 +678,8 @@ class StyledConv(nn.Module):
         upsample=False,
         blur_kernel=[1, 3, 3, 1],
         demodulate=True,
+        fused_upsample=False,
+        modulation='auto',
     ):
         super().__init__()
 
@@ -346,6 +691,8 @@ class StyledConv(nn.Module):
             upsample=upsample,
             blur_kernel=blur_kernel,
             demodulate=demodulate,
+            fused_upsample=fused_upsample,
+            modulation=modulation,
         )
 
         self.noise = NoiseInjection()
@@ -353,33 +700,61 @@ class StyledConv(nn.Module):
         # self.activate = ScaledLeakyReLU(0.2)
         self.activate = FusedLeakyReLU(out_channel)
 
-    def forward(self, input, style, noise=None):
-        out = self.conv(input, style)
-        out = self.noise(out, noise=noise)
-        # out = out + self.bias
-        out = self.activate(out)
+    def forward(self, input, style, noise=None, modulated=False):
+        out = self.conv(input, style, modulated=modulated)
+
+        if noise is None:
+            batch, _, height, width = out.shape
+            noise = out.new_empty(batch, 1, height, width).normal_()
+
+        # self.noise and self.activate in a single pass; without autograd nothing
+        # needs the conv output again, so it is overwritten
+        if torch.is_grad_enabled():
+            activate = fused_noise_leaky_relu
+
+        else:
+            activate = fused_noise_leaky_relu_
+
+        out = activate(
+            out,
+            noise,
+            self.noise.weight,
+            self.activate.bias,
+            self.activate.negative_slope,
+            self.activate.scale,
+        )
 
         return out
 
 
 class ToRGB(nn.Module):
-    def __init__(self, in_channel, style_dim, upsample=True, blur_kernel=[1, 3, 3, 1]):
+    def __init__(
+        self, in_channel, style_dim, upsample=True, blur_kernel=[1, 3, 3, 1], modulation='auto'
+    ):
         super().__init__()
 
         if upsample:
             self.upsample = Upsample(blur_kernel)
 
-        self.conv = ModulatedConv2d(in_channel, 3, 1, style_dim, demodulate=False)
+        self.conv = ModulatedConv2d(
+            in_channel, 3, 1, style_dim, demodulate=False, modulation=modulation
+        )
         self.bias = nn.Parameter(torch.zeros(1, 3, 1, 1))
 
-    def forward(self, input, style, skip=None):
-        out = self.conv(input, style)
-        out = out + self.bias
+    def forward(self, input, style, skip=None, modulated=False):
+        # the RGB skip is summed over every resolution, so it stays in the
+        # parameters' dtype even when the convs run in bfloat16 under autocast
+        out = self.conv(input, style, modulated=modulated).to(self.bias.dtype)
+
+        # without autograd the conv output is not needed again, so the bias and
+        # skip are added in place
+        inplace = not torch.is_grad_enabled()
+        out = out.add_(self.bias) if inplace else out + self.bias
 
         if skip is not None:
             skip = self.upsample(skip)
 
-            out = out + skip
+            out = out.add_(skip) if inplace else out + skip
 
         return out
 
@@ -393,10 +768,14 @@ class Generator(nn.Module):
         channel_multiplier=2,
         blur_kernel=[1, 3, 3, 1],
         lr_mlp=0.01,
+        fused_upsample=False,
+        modulation='auto',
+        channels_last=False,
     ):
         super().__init__()
 
         self.size = size
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
 
         self.style_dim = style_dim
 
@@ -425,9 +804,16 @@ class Generator(nn.Module):
 
         self.input = ConstantInput(self.channels[4])
         self.conv1 = StyledConv(
-            self.channels[4], self.channels[4], 3, style_dim, blur_kernel=blur_kernel
+            self.channels[4],
+            self.channels[4],
+            3,
+            style_dim,
+            blur_kernel=blur_kernel,
+            modulation=modulation,
+        )
+        self.to_rgb1 = ToRGB(
+            self.channels[4], style_dim, upsample=False, modulation=modulation
         )
-        self.to_rgb1 = ToRGB(self.channels[4], style_dim, upsample=False)
 
         self.log_size = int(math.log(size, 2))
         self.num_layers = (self.log_size - 2) * 2 + 1
@@ -455,21 +841,344 @@ class Generator(nn.Module):
                     style_dim,
                     upsample=True,
                     blur_kernel=blur_kernel,
+                    fused_upsample=fused_upsample,
+                    modulation=modulation,
                 )
             )
 
             self.convs.append(
                 StyledConv(
-                    out_channel, out_channel, 3, style_dim, blur_kernel=blur_kernel
+                    out_channel,
+                    out_channel,
+                    3,
+                    style_dim,
+                    blur_kernel=blur_kernel,
+                    modulation=modulation,
                 )
             )
 
-            self.to_rgbs.append(ToRGB(out_channel, style_dim))
+            self.to_rgbs.append(ToRGB(out_channel, style_dim, modulation=modulation))
 
             in_channel = out_channel
 
         self.n_latent = self.log_size * 2 - 2
 
+        # enough for the blocks' receptive field at a tile edge, see synthesize_tiled
+        self.tile_halo = len(blur_kernel)
+
+        # latent row of each modulated conv, in style_convs order
+        style_index = [0, 1]
+
+        for i in range(1, self.num_layers - 1, 2):
+            style_index += [i, i + 1, i + 2]
+
+        self.style_sizes = [conv.in_channel for conv in self.style_convs()]
+
+        # (first layer, number of layers, size, first weight row) of each run of
+        # consecutive layers with one style size; the channels only shrink with
+        # resolution, so there are a handful. See layer_styles.
+        self.style_segments = []
+        offset = 0
+
+        for layer, size in enumerate(self.style_sizes):
+            if self.style_segments and self.style_segments[-1][2] == size:
+                first, count, _, row = self.style_segments[-1]
+                self.style_segments[-1] = (first, count + 1, size, row)
+
+            else:
+                self.style_segments.append((layer, 1, size, offset))
+
+            offset += size
+
+        # where each layer's style sits in the [batch, layer * total] output of
+        # the int8 affine, see layer_styles
+        total = sum(self.style_sizes)
+        style_gather = []
+        offset = 0
+
+        for layer, size in enumerate(self.style_sizes):
+            start = layer * total + offset
+            style_gather += range(start, start + size)
+            offset += size
+
+        # on the CPU even under load_model's meta device, see make_kernel_1d
+        self.register_buffer(
+            'style_index', torch.tensor(style_index, device='cpu'), persistent=False
+        )
+        self.register_buffer(
+            'style_gather', torch.tensor(style_gather, device='cpu'), persistent=False
+        )
+
+        self.frozen = False
+
+        # int8 replacement of the style affines, set by quantize.quantize
+        self.quantized_affine = None
+
+        convert_memory_format(self, self.memory_format)
+
+    def freeze_for_inference(self):
+        """Bakes the per-call constants of every layer into stored tensors for
+        serving; the outputs stay the same. See freeze_for_inference in this
+        module, which also applies to Patch_Discriminator and Trans.
+        """
+
+        freeze_for_inference(self)
+
+        if not self.frozen:
+            weight, bias = self.style_affine()
+            self.register_buffer('style_weight', weight, persistent=False)
+            self.register_buffer('style_bias', bias, persistent=False)
+            self.frozen = True
+
+        return self
+
+    def synthesize_tiled(
+        self, out, skip, layer_styles, noise, blocks, tile_size, tile_batch=None
+    ):
+        # Runs the upsampling blocks on overlapping tiles and returns the RGB
+        # output. Every op in a block is local, so a tile of the output only needs
+        # its own region of out and skip plus a halo. The zero padding at a tile
+        # edge where the neighbouring tile's pixels belong corrupts a band that
+        # grows to 2 * band + len(blur_kernel) pixels per block; starting from a
+        # halo of len(blur_kernel) pixels at the input resolution, the band never
+        # reaches the tile, so the output is the same as the untiled synthesis.
+        # Only one tile's activations are alive at a time.
+        batch, _, height, width = out.shape
+        factor = 2 ** len(blocks)
+        halo = self.tile_halo
+
+        if tile_size % factor:
+            raise ValueError(f'tile_size must be a multiple of {factor}, got {tile_size}')
+
+        span = tile_size // factor
+        tile_batch = tile_batch or batch
+
+        # tiles have to see the same noise as the whole image would, so random
+        # noise is drawn at full size here
+        noise = list(noise)
+
+        for index in blocks:
+            resolution = height * 2 ** (index - blocks[0] + 1)
+
+            for layer in (1 + 2 * index, 2 + 2 * index):
+                if noise[layer] is None:
+                    noise[layer] = out.new_empty(batch, 1, resolution, resolution).normal_()
+
+        image = torch.empty(
+            batch,
+            skip.shape[1],
+            height * factor,
+            width * factor,
+            dtype=skip.dtype,
+            device=skip.device,
+            memory_format=memory_format(skip),
+        )
+
+        for y in range(0, height, span):
+            for x in range(0, width, span):
+                y0, y1 = max(y - halo, 0), min(y + span + halo, height)
+                x0, x1 = max(x - halo, 0), min(x + span + halo, width)
+
+                for n in range(0, batch, tile_batch):
+                    samples = slice(n, n + tile_batch)
+                    tile_out = out[samples, :, y0:y1, x0:x1]
+                    tile_skip = skip[samples, :, y0:y1, x0:x1]
+
+                    for index in blocks:
+                        scale = 2 ** (index - blocks[0] + 1)
+                        i = 2 + 3 * index
+                        tile_noise = []
+
+                        for layer in (1 + 2 * index, 2 + 2 * index):
+                            layer_noise = noise[layer]
+
+                            if layer_noise.shape[0] > 1:
+                                layer_noise = layer_noise[samples]
+
+                            tile_noise.append(
+                                layer_noise[:, :, y0 * scale : y1 * scale, x0 * scale : x1 * scale]
+                            )
+
+                        tile_out = self.convs[2 * index](
+                            tile_out, layer_styles[i][samples], noise=tile_noise[0], modulated=True
+                        )
+                        tile_out = self.convs[2 * index + 1](
+                            tile_out, layer_styles[i + 1][samples], noise=tile_noise[1], modulated=True
+                        )
+                        tile_skip = self.to_rgbs[index](
+                            tile_out, layer_styles[i + 2][samples], tile_skip, modulated=True
+                        )
+
+                    tile_h = (min(y + span, height) - y) * factor
+                    tile_w = (min(x + span, width) - x) * factor
+                    top, left = (y - y0) * factor, (x - x0) * factor
+
+                    image[
+                        samples,
+                        :,
+                        y * factor : y * factor + tile_h,
+                        x * factor : x * factor + tile_w,
+                    ] = tile_skip[:, :, top : top + tile_h, left : left + tile_w]
+
+        return image
+
+    def feature_names(self):
+        # names of the StyledConv layers whose outputs forward can capture, in
+        # order: conv1, convs.0, convs.1, ...
+        return ['conv1'] + [f'convs.{i}' for i in range(len(self.convs))]
+
+    def style_convs(self):
+        convs = [self.conv1.conv, self.to_rgb1.conv]
+
+        for conv1, conv2, to_rgb in zip(self.convs[::2], self.convs[1::2], self.to_rgbs):
+            convs += [conv1.conv, conv2.conv, to_rgb.conv]
+
+        return convs
+
+    def style_affine(self):
+        # weight and bias of every style affine, concatenated in style_convs order
+        if self.frozen:
+            return self.style_weight, self.style_bias
+
+        modulations = [conv.modulation for conv in self.style_convs()]
+
+        # every affine maps style_dim with lr_mul 1, so they share one scale
+        weight = torch.cat([m.weight for m in modulations]) * modulations[0].scale
+        bias = torch.cat([m.bias * m.lr_mul for m in modulations])
+
+        return weight, bias
+
+    def layer_styles(self, latent, broadcast=False):
+        # The style affines of every modulated conv against their concatenated
+        # weights, as per-layer styles. broadcast means every latent row is the
+        # same w, so latent[:, 0] goes through all of them in one matmul.
+        # Otherwise each layer multiplies its own latent row by its own block of
+        # the weight: the layers of each size segment are one batched matmul
+        # over [layer, size, style_dim] views of the weight.
+        if self.quantized_affine is not None:
+            affine = self.quantized_affine
+
+        else:
+            weight, bias = self.style_affine()
+            affine = functools.partial(F.linear, weight=weight, bias=bias)
+
+        if broadcast:
+            return affine(latent[:, 0]).split(self.style_sizes, 1)
+
+        if self.quantized_affine is not None:
+            # the int8 affine only runs whole, so every layer's row goes through
+            # all of it and the diagonal blocks are kept
+            batch = latent.shape[0]
+            styles = affine(latent[:, self.style_index])
+            styles = styles.view(batch, -1).index_select(1, self.style_gather)
+
+            return styles.split(self.style_sizes, 1)
+
+        # [layer, batch, style_dim]
+        rows = latent[:, self.style_index].transpose(0, 1)
+        styles = []
+
+        for first, count, size, row in self.style_segments:
+            end = row + count * size
+            segment = torch.baddbmm(
+                bias[row:end].view(count, 1, size),
+                rows[first : first + count],
+                weight[row:end].view(count, size, -1).transpose(1, 2),
+            )
+            styles += segment.unbind(0)
+
+        return styles
+
+    def style_mixing(
+        self,
+        coarse,
+        fine,
+        inject_index=None,
+        input_is_latent=False,
+        truncation=1,
+        truncation_latent=None,
+        noise=None,
+        randomize_noise=True,
+    ):
+        # images[n, m] of a style mixing grid, the same as
+        # self([coarse[n], fine[m]], inject_index=inject_index)[0]: latent rows
+        # before inject_index come from coarse [N, style_dim], the rest from fine,
+        # [M, style_dim] for every coarse style or [N, M, style_dim] per coarse
+        # style (fine sweeps). The layers that only use coarse rows run once per
+        # coarse style; their out and skip are then broadcast to the N * M
+        # samples, so the grid costs about N coarse and N * M fine evaluations.
+        # Random noise is drawn per coarse style for the shared layers and per
+        # sample after them; given noise has batch 1, N for the shared layers or
+        # N * M after them.
+        if not input_is_latent:
+            coarse = self.style(coarse)
+            fine = self.style(fine.reshape(-1, fine.shape[-1])).view(fine.shape)
+
+        if truncation < 1:
+            coarse = truncation_latent + truncation * (coarse - truncation_latent)
+            fine = truncation_latent + truncation * (fine - truncation_latent)
+
+        if inject_index is None:
+            inject_index = random.randint(1, self.n_latent - 1)
+
+        n = coarse.shape[0]
+
+        if fine.ndim == 2:
+            fine = fine.unsqueeze(0).expand(n, -1, -1)
+
+        m = fine.shape[1]
+
+        if noise is None:
+            if randomize_noise:
+                noise = [None] * self.num_layers
+            else:
+                noise = [
+                    getattr(self.noises, f'noise_{i}') for i in range(self.num_layers)
+                ]
+
+        coarse_styles = self.layer_styles(coarse.unsqueeze(1), broadcast=True)
+        fine_styles = self.layer_styles(fine.reshape(n * m, 1, -1), broadcast=True)
+        rows = self.style_index.tolist()
+
+        def broadcast(tensor):
+            return tensor.unsqueeze(1).expand(-1, m, *tensor.shape[1:]).flatten(0, 1)
+
+        # (module, index into layer_styles, noise layer or None for ToRGB)
+        steps = [(self.conv1, 0, 0), (self.to_rgb1, 1, None)]
+
+        for index, (conv1, conv2, to_rgb) in enumerate(
+            zip(self.convs[::2], self.convs[1::2], self.to_rgbs)
+        ):
+            i = 2 + 3 * index
+            steps += [(conv1, i, 1 + 2 * index), (conv2, i + 1, 2 + 2 * index), (to_rgb, i + 2, None)]
+
+        out = self.input(coarse)
+        skip = None
+        shared = True
+
+        for module, i, layer in steps:
+            if shared and rows[i] >= inject_index:
+                out = broadcast(out)
+                skip = None if skip is None else broadcast(skip)
+                shared = False
+
+            style = coarse_styles[i] if shared else fine_styles[i]
+
+            if layer is None:
+                skip = module(out, style, skip, modulated=True)
+
+            else:
+                out = module(out, style, noise=noise[layer], modulated=True)
+
+        if shared:
+            skip = broadcast(skip)
+
+        return skip.view(n, m, *skip.shape[1:])
+
+    def fixed_shape_inference(self, batch, **kwargs):
+        # see FixedShapeInference; freezes this generator for inference
+        return FixedShapeInference(self, batch, **kwargs)
+
     def make_noise(self):
         device = self.input.input.device
 
@@ -492,6 +1201,18 @@ class Generator(nn.Module):
     def get_latent(self, input):
         return self.style(input)
 
+    def autotune(self, batch=1, backward=False):
+        # picks the fastest op variants for the shapes this generator runs at this
+        # batch size, see op.autotune. Runs on a forked RNG so seeded sampling
+        # afterwards is unaffected.
+        device = self.input.input.device
+        devices = [device] if device.type == 'cuda' else []
+
+        with torch.random.fork_rng(devices):
+            latent_in = torch.randn(batch, self.style_dim, device=device)
+
+            return autotune(lambda: self([latent_in]), backward=backward)
+
     def forward(
         self,
         styles,
@@ -503,7 +1224,66 @@ class Generator(nn.Module):
         noise=None,
         randomize_noise=True,
         return_feats=False,
+        capture=None,
+        max_resolution=None,
+        tile_size=None,
+        tile_from=None,
+        tile_batch=None,
     ):
+        # max_resolution stops synthesis after the block at that resolution and
+        # returns its RGB skip output; deeper blocks are not run
+        n_blocks = len(self.to_rgbs)
+
+        if max_resolution is not None:
+            log_resolution = int(math.log(max_resolution, 2))
+
+            if 2 ** log_resolution != max_resolution or not 2 <= log_resolution <= self.log_size:
+                raise ValueError(
+                    f'max_resolution must be a power of 2 from 4 to {self.size}, got {max_resolution}'
+                )
+
+            n_blocks = log_resolution - 2
+
+        # capture: the feature layers to return, as indices into feature_names()
+        # or names from it, in the order wanted. Only those activations are kept;
+        # return_feats alone captures all of them. Synthesis up to max_resolution
+        # runs the layers 0 to 2 * n_blocks.
+        n_features = 1 + 2 * n_blocks
+
+        if return_feats and capture is None:
+            capture = range(n_features)
+
+        # tile_size runs the blocks above tile_from (default: 256 px, or half the
+        # output resolution if that is smaller) on output tiles of that size, and
+        # tile_batch samples at a time; see synthesize_tiled
+        tiled_from = n_blocks
+
+        if tile_size is not None:
+            if tile_from is None:
+                tile_from = min(256, 2 ** (n_blocks + 1))
+
+            tiled_from = min(max(int(math.log(tile_from, 2)) - 2, 0), n_blocks)
+
+        if capture is not None:
+            names = self.feature_names()
+            capture = [names.index(c) if isinstance(c, str) else c for c in capture]
+            feat_list = [None] * len(capture)
+
+            for c in capture:
+                if not 0 <= c < n_features:
+                    raise ValueError(
+                        f'capture index {c} is outside the {n_features} layers synthesized'
+                    )
+
+            if capture and tiled_from < n_blocks and max(capture) > tiled_from * 2:
+                raise ValueError('features of tiled layers can not be captured')
+
+        def keep(layer, out):
+            if capture is not None:
+                for position, c in enumerate(capture):
+                    if c == layer:
+                        feat_list[position] = out
+
         if not input_is_latent:
             styles = [self.style(s) for s in styles]
 
@@ -531,7 +1311,7 @@ class Generator(nn.Module):
             inject_index = self.n_latent
 
             if styles[0].ndim < 3:
-                latent = styles[0].unsqueeze(1).repeat(1, inject_index, 1)
+                latent = styles[0].unsqueeze(1).expand(-1, inject_index, -1)
 
             else:
                 latent = styles[0]
@@ -541,43 +1321,391 @@ class Generator(nn.Module):
             if inject_index is None:
                 inject_index = random.randint(1, self.n_latent - 1)
 
-            latent = styles[0].unsqueeze(1).repeat(1, inject_index, 1)
-            latent2 = styles[1].unsqueeze(1).repeat(1, self.n_latent - inject_index, 1)
+            latent = styles[0].unsqueeze(1).expand(-1, inject_index, -1)
+            latent2 = styles[1].unsqueeze(1).expand(-1, self.n_latent - inject_index, -1)
             latent = torch.cat([latent, latent2], 1)
 
             #latent = styles[0].unsqueeze(1).repeat(1, self.n_latent, 1)
             #latent[:, inject_index-1, :] = styles[1]
 
-        feat_list = []
+        # a single w is only expanded, not copied, and then only needs one row of
+        # affines; path length regularization differentiates per latent row, so
+        # returned latents always go through the gathered rows
+        broadcast = latent.stride(1) == 0 and not return_latents
+        layer_styles = self.layer_styles(latent, broadcast)
+
         out = self.input(latent)
-        out = self.conv1(out, latent[:, 0], noise=noise[0])
-        feat_list.append(out)
-        skip = self.to_rgb1(out, latent[:, 1])
+        out = self.conv1(out, layer_styles[0], noise=noise[0], modulated=True)
+        keep(0, out)
+        skip = self.to_rgb1(out, layer_styles[1], modulated=True)
 
-        i = 1
+        i = 2
+        layer = 1
         for conv1, conv2, noise1, noise2, to_rgb in zip(
-            self.convs[::2], self.convs[1::2], noise[1::2], noise[2::2], self.to_rgbs
+            self.convs[::2],
+            self.convs[1::2],
+            noise[1::2],
+            noise[2::2],
+            self.to_rgbs[:tiled_from],
         ):
-            out = conv1(out, latent[:, i], noise=noise1)
-            feat_list.append(out)
-            out = conv2(out, latent[:, i + 1], noise=noise2)
-            feat_list.append(out)
-            skip = to_rgb(out, latent[:, i + 2], skip)
-
-
-            i += 2
+            out = conv1(out, layer_styles[i], noise=noise1, modulated=True)
+            keep(layer, out)
+            out = conv2(out, layer_styles[i + 1], noise=noise2, modulated=True)
+            keep(layer + 1, out)
+            skip = to_rgb(out, layer_styles[i + 2], skip, modulated=True)
+
+
+            i += 3
+            layer += 2
+
+        if tiled_from < n_blocks:
+            skip = self.synthesize_tiled(
+                out,
+                skip,
+                layer_styles,
+                noise,
+                range(tiled_from, n_blocks),
+                tile_size,
+                tile_batch,
+            )
 
         image = skip
         if return_latents:
             return image, latent
         
-        elif return_feats:
+        elif capture is not None:
             return image, feat_list
         
         else:
             return image, None
 
 
+class FixedShapeInference:
+    """Runs a CUDA generator over and over at one batch size, for serving.
+
+    The latent input, the noise and the output live in buffers allocated once;
+    noise is redrawn in place, and the bias, noise, activation and skip
+    additions run in place on the conv outputs (as they do whenever autograd is
+    off). The whole forward is captured once as a CUDA graph: the capture plans
+    the lifetime of every intermediate tensor in a private memory pool, and
+    each call only replays it, so steady-state calls allocate nothing. Torch
+    convs have no preallocated-output form on the CPU, so there is no such plan
+    there, and a CPU generator raises ValueError.
+
+    Every call returns the same output tensor, which the next call overwrites.
+    kwargs are forward's input_is_latent, truncation and truncation_latent.
+    """
+
+    def __init__(self, generator, batch, randomize_noise=True, warmup=3, **kwargs):
+        device = generator.input.input.device
+
+        if device.type != 'cuda':
+            raise ValueError(
+                f'fixed-shape inference needs a CUDA generator, got one on {device.type}'
+            )
+
+        self.generator = generator.freeze_for_inference()
+        self.kwargs = kwargs
+        self.randomize_noise = randomize_noise
+
+        buffers = [getattr(generator.noises, f'noise_{i}') for i in range(generator.num_layers)]
+
+        self.latent = torch.zeros(batch, generator.style_dim, device=device)
+
+        if randomize_noise:
+            self.noise = [
+                torch.empty(batch, 1, *buffer.shape[2:], device=device) for buffer in buffers
+            ]
+
+        else:
+            self.noise = buffers
+
+        with torch.no_grad():
+            # warm up (op plans, autotune lookups, cuDNN algorithms) on a side
+            # stream, as capture requires
+            stream = torch.cuda.Stream(device)
+            stream.wait_stream(torch.cuda.current_stream(device))
+
+            with torch.cuda.stream(stream):
+                for _ in range(warmup):
+                    self.run()
+
+            torch.cuda.current_stream(device).wait_stream(stream)
+
+            self.graph = torch.cuda.CUDAGraph()
+
+            with torch.cuda.graph(self.graph):
+                self.image = self.run()
+
+    def run(self):
+        if self.randomize_noise:
+            for noise in self.noise:
+                noise.normal_()
+
+        image, _ = self.generator(
+            [self.latent], noise=self.noise, randomize_noise=False, **self.kwargs
+        )
+
+        return image
+
+    def __call__(self, latent):
+        self.latent.copy_(latent)
+        self.graph.replay()
+
+        return self.image
+
+
+def get_tensor(module, name):
+    # the parameter or buffer name of module, a dotted path
+    path, _, leaf = name.rpartition('.')
+
+    return getattr(module.get_submodule(path), leaf)
+
+
+def set_tensor(module, name, value):
+    # replaces the parameter or buffer name of module by value, keeping its kind
+    path, _, leaf = name.rpartition('.')
+    module = module.get_submodule(path)
+
+    if leaf in module._parameters:
+        module._parameters[leaf] = nn.Parameter(value, requires_grad=False)
+
+    else:
+        module._buffers[leaf] = value
+
+
+class MultiGenerator(nn.Module):
+    """Serves K generators of one architecture, such as adaptations of the same
+    source generator to different domains, in mixed batches where each sample
+    names the generator it comes from.
+
+    Every tensor forward reads that differs between the generators is stacked
+    into a [K, ...] buffer; the ones they all share (untouched layers) are kept
+    once, in the template generator (the first one). For sample i of
+    generator model[i], each modulated conv uses the weight
+    stacked_weight[model[i]] * style[i], which is just another per-sample
+    weight, so the synthesis of the whole batch is one grouped conv per layer
+    (see ModulatedConv2d.forward_grouped) whatever the mix of generators. The
+    biases, noise strengths, constant input and noise buffers are gathered per
+    sample the same way; the mapping network and the style affines run once per
+    generator present in the batch.
+    """
+
+    def __init__(self, generators):
+        super().__init__()
+
+        frozen = [copy.deepcopy(g).freeze_for_inference() for g in generators]
+
+        self.generator = frozen[0]
+        self.n_models = len(frozen)
+
+        # generator tensor name -> name of its [K, ...] buffer here
+        self.stacked = {}
+
+        tensors = [{**dict(g.named_parameters()), **dict(g.named_buffers())} for g in frozen]
+
+        for name in self.served_tensors():
+            tensor = tensors[0][name]
+            values = [t[name] for t in tensors]
+
+            if all(torch.equal(value, tensor) for value in values[1:]):
+                continue
+
+            buffer = f'stacked_{len(self.stacked)}'
+            self.register_buffer(buffer, torch.stack(values), persistent=False)
+            self.stacked[name] = buffer
+
+            # the template keeps a view of the stack rather than its own copy
+            set_tensor(self.generator, name, getattr(self, buffer)[0])
+
+    def served_tensors(self):
+        # names of the generator tensors forward reads; the rest (the frozen
+        # weight norms, the per-layer modulations behind style_weight, ...) are
+        # only used by the template's own forward and are not stacked
+        g = self.generator
+        style = {**dict(g.style.named_parameters()), **dict(g.style.named_buffers())}
+        names = ['input.input', 'style_weight', 'style_bias']
+        names += [f'style.{name}' for name in style]
+        names += [f'noises.noise_{i}' for i in range(g.num_layers)]
+
+        for name in ['conv1'] + [f'convs.{i}' for i in range(len(g.convs))]:
+            names += [f'{name}.conv.weight', f'{name}.activate.bias', f'{name}.noise.weight']
+
+        for name in ['to_rgb1'] + [f'to_rgbs.{i}' for i in range(len(g.to_rgbs))]:
+            names += [f'{name}.conv.weight', f'{name}.bias']
+
+        return names
+
+    @classmethod
+    def from_checkpoints(cls, paths, *args, key='g_ema', device='cpu', **kwargs):
+        # Generator(*args, **kwargs) with the weights of each checkpoint
+        generators = [
+            load_model(
+                Generator,
+                unwrap_state_dict(torch.load(path, map_location='cpu')[key]),
+                *args,
+                device=device,
+                strict=False,
+                **kwargs,
+            )
+            for path in paths
+        ]
+
+        return cls(generators)
+
+    def model_tensor(self, name, k):
+        # generator k's tensor name
+        if name in self.stacked:
+            return getattr(self, self.stacked[name])[k]
+
+        return get_tensor(self.generator, name)
+
+    def per_sample(self, name, model):
+        # the tensor name of each sample's generator, [batch, ...], or [1, ...]
+        # when the generators share it
+        if name in self.stacked:
+            return getattr(self, self.stacked[name]).index_select(0, model)
+
+        return get_tensor(self.generator, name).unsqueeze(0)
+
+    def per_model(self, fn, input, model):
+        # fn(k, rows) on the rows of input that belong to each generator k
+        out = None
+
+        for k in model.unique().tolist():
+            index = (model == k).nonzero().squeeze(1)
+            rows = fn(k, input.index_select(0, index))
+
+            if out is None:
+                out = rows.new_empty(input.shape[0], *rows.shape[1:])
+
+            out[index] = rows
+
+        return out
+
+    def mapping(self, z, model):
+        names = [name for name in self.stacked if name.startswith('style.')]
+
+        if not names:
+            return self.generator.style(z)
+
+        def style(k, rows):
+            tensors = {name[len('style.') :]: self.model_tensor(name, k) for name in names}
+
+            return functional_call(self.generator.style, tensors, (rows,))
+
+        return self.per_model(style, z, model)
+
+    def layer_styles(self, latent, model):
+        # every sample has one w, so this is Generator.layer_styles with broadcast
+        if 'style_weight' in self.stacked or 'style_bias' in self.stacked:
+            styles = self.per_model(
+                lambda k, rows: F.linear(
+                    rows, self.model_tensor('style_weight', k), self.model_tensor('style_bias', k)
+                ),
+                latent,
+                model,
+            )
+
+        else:
+            styles = F.linear(latent, self.generator.style_weight, self.generator.style_bias)
+
+        return styles.split(self.generator.style_sizes, 1)
+
+    def mean_latent(self, n_latent):
+        # [K, style_dim], the mean w of each generator
+        g = self.generator
+        latent_in = torch.randn(n_latent, g.style_dim, device=g.input.input.device)
+        latents = []
+
+        for k in range(self.n_models):
+            model = torch.full((n_latent,), k, dtype=torch.long, device=latent_in.device)
+            latents.append(self.mapping(latent_in, model).mean(0))
+
+        return torch.stack(latents)
+
+    def styled_conv(self, name, module, input, style, noise, model):
+        # module (a StyledConv of the template) with each sample's weights
+        batch = input.shape[0]
+        weight = self.per_sample(f'{name}.conv.weight', model).flatten(0, 1)
+        out = module.conv.forward_grouped(input, style.view(batch, 1, -1, 1, 1), weight)
+
+        _, channel, height, width = out.shape
+        bias = self.per_sample(f'{name}.activate.bias', model).view(-1, channel, 1, 1)
+        noise_weight = self.per_sample(f'{name}.noise.weight', model).view(-1, 1, 1, 1)
+
+        if noise is None:
+            noise = out.new_empty(batch, 1, height, width).normal_()
+
+        out = out + bias + noise_weight * noise
+
+        return F.leaky_relu(out, module.activate.negative_slope) * module.activate.scale
+
+    def to_rgb(self, name, module, input, style, skip, model):
+        batch = input.shape[0]
+        weight = self.per_sample(f'{name}.conv.weight', model).flatten(0, 1)
+        out = module.conv.forward_grouped(input, style.view(batch, 1, -1, 1, 1), weight)
+        out = out + self.per_sample(f'{name}.bias', model).flatten(0, 1)
+
+        if skip is not None:
+            out = out + module.upsample(skip)
+
+        return out
+
+    def forward(
+        self,
+        input,
+        model,
+        input_is_latent=False,
+        truncation=1,
+        truncation_latent=None,
+        noise=None,
+        randomize_noise=True,
+    ):
+        # input: [batch, style_dim] z, or w with input_is_latent; model: [batch]
+        # index of each sample's generator; truncation_latent: [K, style_dim],
+        # see mean_latent. Returns (images, None) like Generator.
+        g = self.generator
+        batch = input.shape[0]
+        model = torch.as_tensor(model, dtype=torch.long, device=input.device)
+
+        latent = input if input_is_latent else self.mapping(input, model)
+
+        if truncation < 1:
+            mean = truncation_latent.index_select(0, model)
+            latent = mean + truncation * (latent - mean)
+
+        if noise is None:
+            if randomize_noise:
+                noise = [None] * g.num_layers
+
+            else:
+                noise = [
+                    self.per_sample(f'noises.noise_{i}', model).flatten(0, 1)
+                    for i in range(g.num_layers)
+                ]
+
+        styles = self.layer_styles(latent, model)
+
+        out = self.per_sample('input.input', model).flatten(0, 1).expand(batch, -1, -1, -1)
+        out = self.styled_conv('conv1', g.conv1, out, styles[0], noise[0], model)
+        skip = self.to_rgb('to_rgb1', g.to_rgb1, out, styles[1], None, model)
+
+        for index, (conv1, conv2, to_rgb) in enumerate(
+            zip(g.convs[::2], g.convs[1::2], g.to_rgbs)
+        ):
+            i = 2 + 3 * index
+            out = self.styled_conv(
+                f'convs.{2 * index}', conv1, out, styles[i], noise[1 + 2 * index], model
+            )
+            out = self.styled_conv(
+                f'convs.{2 * index + 1}', conv2, out, styles[i + 1], noise[2 + 2 * index], model
+            )
+            skip = self.to_rgb(f'to_rgbs.{index}', to_rgb, out, styles[i + 2], skip, model)
+
+        return skip, None
+
+
 class ConvLayer(nn.Sequential):
     def __init__(
         self,
@@ -588,6 +1716,7 @@ class ConvLayer(nn.Sequential):
         blur_kernel=[1, 3, 3, 1],
         bias=True,
         activate=True,
+        fused_downsample=False,
     ):
         layers = []
 
@@ -626,16 +1755,93 @@ class ConvLayer(nn.Sequential):
 
         super().__init__(*layers)
 
+        self.fused_downsample = fused_downsample and downsample
+
+    def forward(self, input):
+        if self.fused_downsample:
+            return self.forward_fused_downsample(input)
+
+        return super().forward(input)
+
+    def freeze(self):
+        if self.fused_downsample and not hasattr(self, 'composed_weight_frozen'):
+            self[1].freeze()
+            self.register_buffer('composed_weight_frozen', self.composed_weight().detach())
+
+    def composed_weight(self):
+        # F.conv2d correlates, so the blur enters the composed weight flipped
+        if hasattr(self, 'composed_weight_frozen'):
+            return self.composed_weight_frozen
+
+        blur, conv = self[0], self[1]
+        out_channel, in_channel, kernel_size, _ = conv.weight.shape
+        pad = blur.kernel.shape[0] - 1
+        kernel_1d = blur.kernel_1d
+
+        if kernel_1d is not None:
+            kernel_1d = torch.flip(kernel_1d, [0])
+
+        weight = upfirdn2d(
+            conv.scaled_weight().view(-1, 1, kernel_size, kernel_size),
+            torch.flip(blur.kernel, [0, 1]),
+            pad=(pad, pad),
+            kernel_1d=kernel_1d,
+        )
+
+        return weight.view(out_channel, in_channel, kernel_size + pad, kernel_size + pad)
+
+    def forward_fused_downsample(self, input):
+        # conv(blur(x), w) == conv(x, w * blur): the blur is folded into the conv
+        # weight once per call, so the strided conv reads the full resolution input
+        # directly instead of after a separate blur pass. The composed kernel is
+        # larger, so this trades conv FLOPs for one less full resolution activation.
+        blur, conv = self[0], self[1]
+        weight = self.composed_weight()
+        pad0, pad1 = blur.pad
+
+        if pad0 == pad1:
+            padding = pad0
+
+        else:
+            input = F.pad(input, [pad0, pad1, pad0, pad1])
+            padding = 0
+
+        out = F.conv2d(input, weight, bias=conv.bias, stride=2, padding=padding)
+
+        for layer in list(self)[2:]:
+            out = layer(out)
+
+        return out
+
 
 class ResBlock(nn.Module):
-    def __init__(self, in_channel, out_channel, blur_kernel=[1, 3, 3, 1], downsample=True):
+    def __init__(
+        self,
+        in_channel,
+        out_channel,
+        blur_kernel=[1, 3, 3, 1],
+        downsample=True,
+        fused_downsample=False,
+    ):
         super().__init__()
 
         self.conv1 = ConvLayer(in_channel, in_channel, 3)
-        self.conv2 = ConvLayer(in_channel, out_channel, 3, downsample=downsample)
+        self.conv2 = ConvLayer(
+            in_channel,
+            out_channel,
+            3,
+            downsample=downsample,
+            fused_downsample=fused_downsample,
+        )
 
         self.skip = ConvLayer(
-            in_channel, out_channel, 1, downsample=downsample, activate=False, bias=False
+            in_channel,
+            out_channel,
+            1,
+            downsample=downsample,
+            activate=False,
+            bias=False,
+            fused_downsample=fused_downsample,
         )
 
     def forward(self, input):
@@ -648,9 +1854,18 @@ class ResBlock(nn.Module):
 
 
 class Discriminator(nn.Module):
-    def __init__(self, size, channel_multiplier=2, blur_kernel=[1, 3, 3, 1]):
+    def __init__(
+        self,
+        size,
+        channel_multiplier=2,
+        blur_kernel=[1, 3, 3, 1],
+        fused_downsample=False,
+        channels_last=False,
+    ):
         super().__init__()
 
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
         channels = {
             4: 512,
             8: 512,
@@ -672,7 +1887,11 @@ class Discriminator(nn.Module):
         for i in range(log_size, 2, -1):
             out_channel = channels[2 ** (i - 1)]
 
-            convs.append(ResBlock(in_channel, out_channel, blur_kernel))
+            convs.append(
+                ResBlock(
+                    in_channel, out_channel, blur_kernel, fused_downsample=fused_downsample
+                )
+            )
 
             in_channel = out_channel
 
@@ -687,10 +1906,17 @@ class Discriminator(nn.Module):
             EqualLinear(channels[4], 1),
         )
 
+        convert_memory_format(self, self.memory_format)
+
+
 
 
+    def freeze_for_inference(self):
+        # see Generator.freeze_for_inference
+        return freeze_for_inference(self)
 
     def forward(self, inp, ind = None, real = False):
+        inp = inp.contiguous(memory_format=self.memory_format)
 
         feat = []
         for i in range(len(self.convs)):
@@ -714,21 +1940,30 @@ class Discriminator(nn.Module):
         stddev = torch.sqrt(stddev.var(0, unbiased=False) + 1e-8)
         stddev = stddev.mean([2, 3, 4], keepdims=True).squeeze(2)
         stddev = stddev.repeat(group, 1, height, width)
-        out = torch.cat([out, stddev], 1)
+        out = torch.cat([out, stddev.contiguous(memory_format=memory_format(out))], 1)
 
 
         out = self.final_conv(out)
         feat.append(out)
-        out = out.view(batch, -1)
+        out = out.reshape(batch, -1)
         out = self.final_linear(out)
 
         return out, feat
 
 
 class Patch_Discriminator(nn.Module):
-    def __init__(self, size, channel_multiplier=2, blur_kernel=[1, 3, 3, 1]):
+    def __init__(
+        self,
+        size,
+        channel_multiplier=2,
+        blur_kernel=[1, 3, 3, 1],
+        fused_downsample=False,
+        channels_last=False,
+    ):
         super().__init__()
 
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
         channels = {
             4: 512,
             8: 512,
@@ -750,7 +1985,11 @@ class Patch_Discriminator(nn.Module):
         for i in range(log_size, 2, -1):
             out_channel = channels[2 ** (i - 1)]
 
-            convs.append(ResBlock(in_channel, out_channel, blur_kernel))
+            convs.append(
+                ResBlock(
+                    in_channel, out_channel, blur_kernel, fused_downsample=fused_downsample
+                )
+            )
 
             in_channel = out_channel
 
@@ -764,8 +2003,15 @@ class Patch_Discriminator(nn.Module):
             EqualLinear(channels[4], 1),
         )
 
+        convert_memory_format(self, self.memory_format)
+
+
+    def freeze_for_inference(self):
+        # see Generator.freeze_for_inference
+        return freeze_for_inference(self)
 
     def forward(self, inp, ind = None, extra = None, flag = None, p_ind = None, real=False):
+        inp = inp.contiguous(memory_format=self.memory_format)
 
         feat = []
         for i in range(len(self.convs)):
@@ -793,11 +2039,11 @@ class Patch_Discriminator(nn.Module):
         stddev = torch.sqrt(stddev.var(0, unbiased=False) + 1e-8)
         stddev = stddev.mean([2, 3, 4], keepdims=True).squeeze(2)
         stddev = stddev.repeat(group, 1, height, width)
-        out = torch.cat([out, stddev], 1)
+        out = torch.cat([out, stddev.contiguous(memory_format=memory_format(out))], 1)
 
         out = self.final_conv(out)
         feat.append(out)
-        out = out.view(batch, -1)
+        out = out.reshape(batch, -1)
         out = self.final_linear(out)
         return out, None 
 
@@ -1004,6 +2250,8 @@ class Trans(nn.Module):
         num_image_channels (int): Number of input image channels.
         weight_norm_type (str): Type of weight normalization.
             ``'none'``, ``'spectral'``, or ``'weight'``.
+        channels_last (bool): Keep parameters and activations in the
+            channels_last memory format.
     """
 
     def __init__(self,
@@ -1016,9 +2264,12 @@ class Trans(nn.Module):
                  num_downsamples_style=4,
                  num_downsamples_content=2,
                  num_image_channels=3,
+                 channels_last=False,
                 ):
         super().__init__()
 
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
         self.style_encoder = StyleEncoder(num_downsamples_style,
                                           num_image_channels,
                                           num_filters,
@@ -1059,6 +2310,15 @@ class Trans(nn.Module):
                        norm='none',
                        activ='relu')
 
+        convert_memory_format(self, self.memory_format)
+
+
+    def freeze_for_inference(self):
+        r"""Fold per-call constants into stored tensors for serving, see
+        Generator.freeze_for_inference. The AdaIN layers of the decoder stop
+        repeating their running statistics on every call.
+        """
+        return freeze_for_inference(self)
 
     def forward(self, style_image, content_image):
         r"""Reconstruct the input image by combining the computer content and
@@ -1078,8 +2338,10 @@ class Trans(nn.Module):
         Args:
             images (tensor): Input image tensor.
         """
-        style = self.style_encoder(style_image.unsqueeze(0))
-        content = self.content_encoder(content_image.unsqueeze(0))
+        style_image = style_image.unsqueeze(0).contiguous(memory_format=self.memory_format)
+        content_image = content_image.unsqueeze(0).contiguous(memory_format=self.memory_format)
+        style = self.style_encoder(style_image)
+        content = self.content_encoder(content_image)
         # style = style.view(style.size(0),-1)
         # content = content.mean(3).mean(2)
         # print(style.shape, content.shape, 'style, content')
@@ -1,10 +1,82 @@
-# from .fused_act import FusedLeakyReLU, fused_leaky_relu
-# from .upfirdn2d import upfirdn2d
+import logging
+import os
+
 import torch
 from torch import nn
-import torch.nn.functional as F
 
+from . import fused_act, native, registry
+from . import upfirdn2d as upfirdn2d_ext
+from .loader import load_extension
+from .native import fused_noise_leaky_relu, fused_noise_leaky_relu_, memory_format
+from .registry import autotune
+
+
+logger = logging.getLogger(__name__)
+
+# op -> extension that implements it
+EXTENSION_NAMES = {'upfirdn2d': 'upfirdn2d', 'fused_leaky_relu': 'fused'}
+
+_backends = {}
+
+
+def extension_available(op, device):
+    # PIR_OP_BACKEND=native skips the extensions entirely
+    if os.environ.get('PIR_OP_BACKEND', 'auto') == 'native':
+        return False
+
+    if device.type not in ('cpu', 'cuda'):
+        return False
+
+    module = load_extension(EXTENSION_NAMES[op])
+
+    return module is not None and (device.type == 'cpu' or module.with_cuda)
+
+
+def extension_supports(input):
+    # the extensions work on NCHW and would convert a channels_last input, and
+    # the CUDA kernels have no bfloat16
+    if memory_format(input) == torch.channels_last:
+        return False
+
+    return not (input.dtype == torch.bfloat16 and input.device.type == 'cuda')
+
+
+def extension_accepts(op, input):
+    return extension_supports(input) and extension_available(op, input.device)
+
+
+def default_variant(op, input):
+    if not extension_supports(input):
+        return 'native'
+
+    return backend(op, input.device)
+
+
+def backend(op, device):
+    # 'extension' or 'native', decided (and logged) once per op and device type;
+    # used for every call that autotune has no choice for
+    key = (op, device.type)
+
+    if key not in _backends:
+        choice = 'extension' if extension_available(op, device) else 'native'
+
+        logger.info('%s on %s: using the %s backend', op, device.type, choice)
+        _backends[key] = choice
+
+    return _backends[key]
+
+
+def compiled(fn):
+    # torch.compile'd fn, built on first use; only registered when torch has compile
+    cache = []
 
+    def wrapper(*args, **kwargs):
+        if not cache:
+            cache.append(torch.compile(fn, dynamic=False))
+
+        return cache[0](*args, **kwargs)
+
+    return wrapper
 
 
 class FusedLeakyReLU(nn.Module):
@@ -14,57 +86,114 @@ class FusedLeakyReLU(nn.Module):
         self.bias = nn.Parameter(torch.zeros(channel))
         self.negative_slope = negative_slope
         self.scale = scale
-        
 
     def forward(self, input):
         return fused_leaky_relu(input, self.bias, self.negative_slope, self.scale)
 
 
 def fused_leaky_relu(input, bias, negative_slope=0.2, scale=2 ** 0.5):
-    # print(input.shape, bias.shape,bias.view((1, -1) + (1,) * (len(input.shape) - 2)).shape)
-    return scale * F.leaky_relu(input + bias.view((1, -1) + (1,) * (len(input.shape) - 2)),
-                                negative_slope=negative_slope)
-
-
-def upfirdn2d_native(
-    input, kernel, up_x, up_y, down_x, down_y, pad_x0, pad_x1, pad_y0, pad_y1
-):
-    input = input.permute(0, 2, 3, 1)
-    _, in_h, in_w, minor = input.shape
-    kernel_h, kernel_w = kernel.shape
-    out = input.view(-1, in_h, 1, in_w, 1, minor)
-    out = F.pad(out, [0, 0, 0, up_x - 1, 0, 0, 0, up_y - 1])
-    out = out.view(-1, in_h * up_y, in_w * up_x, minor)
-
-    out = F.pad(
-        out, [0, 0, max(pad_x0, 0), max(pad_x1, 0), max(pad_y0, 0), max(pad_y1, 0)]
+    return registry.dispatch('fused_leaky_relu', input, bias, negative_slope, scale)
+
+
+def upfirdn2d(input, kernel, up=1, down=1, pad=(0, 0), kernel_1d=None, plans=None):
+    return registry.dispatch(
+        'upfirdn2d', input, kernel, up, down, pad, kernel_1d=kernel_1d, plans=plans
     )
-    out = out[
-        :,
-        max(-pad_y0, 0) : out.shape[1] - max(-pad_y1, 0),
-        max(-pad_x0, 0) : out.shape[2] - max(-pad_x1, 0),
-        :,
-    ]
-
-    out = out.permute(0, 3, 1, 2)
-    out = out.reshape(
-        [-1, 1, in_h * up_y + pad_y0 + pad_y1, in_w * up_x + pad_x0 + pad_x1]
+
+
+def fused_leaky_relu_key(input, bias, negative_slope=0.2, scale=2 ** 0.5):
+    return (
+        tuple(input.shape),
+        str(input.dtype),
+        input.device.type,
+        str(memory_format(input)),
+        negative_slope,
+        scale,
     )
-    w = torch.flip(kernel, [0, 1]).view(1, 1, kernel_h, kernel_w)
-    out = F.conv2d(out, w)
-    out = out.reshape(
-        -1,
-        minor,
-        in_h * up_y + pad_y0 + pad_y1 - kernel_h + 1,
-        in_w * up_x + pad_x0 + pad_x1 - kernel_w + 1,
+
+
+def upfirdn2d_key(input, kernel, up=1, down=1, pad=(0, 0), kernel_1d=None, plans=None):
+    return (
+        tuple(input.shape),
+        str(input.dtype),
+        input.device.type,
+        str(memory_format(input)),
+        tuple(kernel.shape),
+        up,
+        down,
+        tuple(pad),
+        kernel_1d is not None,
     )
-    # out = out.permute(0, 2, 3, 1)
-    return out[:, :, ::down_y, ::down_x]
 
 
-def upfirdn2d(input, kernel, up=1, down=1, pad=(0, 0)):
-    # out = UpFirDn2d.apply(
-    #     input, kernel, (up, up), (down, down), (pad[0], pad[1], pad[0], pad[1])
-    # )
-    out = upfirdn2d_native(input, kernel, up, up, down, down, pad[0], pad[1], pad[0], pad[1])
-    return out
+registry.register_op(
+    'fused_leaky_relu',
+    fused_leaky_relu_key,
+    lambda input, *args: default_variant('fused_leaky_relu', input),
+)
+registry.register_op(
+    'upfirdn2d',
+    upfirdn2d_key,
+    lambda input, *args, **kwargs: default_variant('upfirdn2d', input),
+)
+
+
+@registry.register('fused_leaky_relu', 'native')
+def fused_leaky_relu_native(input, bias, negative_slope=0.2, scale=2 ** 0.5):
+    return native.fused_leaky_relu(input, bias, negative_slope, scale)
+
+
+@registry.register(
+    'fused_leaky_relu',
+    'extension',
+    lambda input, *args: extension_accepts('fused_leaky_relu', input),
+)
+def fused_leaky_relu_extension(input, bias, negative_slope=0.2, scale=2 ** 0.5):
+    return fused_act.fused_leaky_relu(input, bias, negative_slope, scale)
+
+
+def upfirdn2d_plan_variant(mode):
+    # native.upfirdn2d with the plan mode forced; None lets the plan choose
+    def variant(input, kernel, up=1, down=1, pad=(0, 0), kernel_1d=None, plans=None):
+        return native.upfirdn2d(
+            input, kernel, up, down, pad, kernel_1d=kernel_1d, plans=plans, mode=mode
+        )
+
+    return variant
+
+
+def upfirdn2d_reference(input, kernel, up=1, down=1, pad=(0, 0), kernel_1d=None, plans=None):
+    return native.upfirdn2d_native(
+        input, kernel, up, up, down, down, pad[0], pad[1], pad[0], pad[1]
+    )
+
+
+registry.register('upfirdn2d', 'native')(upfirdn2d_plan_variant(None))
+registry.register('upfirdn2d', 'direct')(upfirdn2d_plan_variant('direct'))
+registry.register(
+    'upfirdn2d',
+    'separable',
+    lambda input, kernel, *args, kernel_1d=None, **kwargs: kernel_1d is not None,
+)(upfirdn2d_plan_variant('separable'))
+registry.register(
+    'upfirdn2d',
+    'polyphase',
+    lambda input, kernel, up=1, *args, **kwargs: up > 1 and min(kernel.shape) >= up,
+)(upfirdn2d_plan_variant('polyphase'))
+registry.register('upfirdn2d', 'reference')(upfirdn2d_reference)
+
+
+@registry.register(
+    'upfirdn2d',
+    'extension',
+    lambda input, *args, **kwargs: extension_accepts('upfirdn2d', input),
+)
+def upfirdn2d_extension(input, kernel, up=1, down=1, pad=(0, 0), kernel_1d=None, plans=None):
+    return upfirdn2d_ext.upfirdn2d(input, kernel, up, down, pad)
+
+
+if hasattr(torch, 'compile'):
+    registry.register('fused_leaky_relu', 'compiled')(
+        compiled(native.fused_leaky_relu)
+    )
+    registry.register('upfirdn2d', 'compiled')(compiled(upfirdn2d_reference))
@@ -0,0 +1,241 @@
+# Microbenchmarks of the op/ variants on the calls the models actually make:
+#
+#     python -m op.benchmark --size 256 512 1024 --batch 4 --out bench.json
+#
+# Every distinct upfirdn2d / fused_leaky_relu call of a Generator and a
+# Patch_Discriminator forward is recorded at batch 1, then timed at --batch with
+# each available variant: forward, backward and double backward (as in the R1
+# and path length regularizers), with peak memory and throughput. The
+# results are written as JSON, one record per (model, size, call, variant).
+import argparse
+import json
+import logging
+
+import torch
+from torch import autograd
+
+from . import registry
+from .native import memory_format
+
+
+logger = logging.getLogger(__name__)
+
+
+def record_calls(model, inputs, **kwargs):
+    with registry.record() as calls:
+        with torch.no_grad():
+            model(inputs, **kwargs)
+
+    return calls
+
+
+def model_calls(size, device, channel_multiplier=2, channels_last=False):
+    # {model name: recorded calls} for the generator and discriminator at size
+    from model import Generator, Patch_Discriminator
+
+    generator = Generator(
+        size, 512, 8, channel_multiplier=channel_multiplier, channels_last=channels_last
+    ).to(device)
+    latent = torch.randn(1, 512, device=device)
+    calls = {'Generator': record_calls(generator, [latent])}
+    del generator
+
+    discriminator = Patch_Discriminator(
+        size, channel_multiplier=channel_multiplier, channels_last=channels_last
+    ).to(device)
+    image = torch.randn(1, 3, size, size, device=device)
+    calls['Patch_Discriminator'] = record_calls(discriminator, image, flag=0)
+
+    return calls
+
+
+def call_inputs(args, kwargs, batch):
+    # the recorded call with a fresh random input at the benchmark batch size and
+    # an empty plan cache, so plans are built during warmup
+    input = args[0]
+    input = torch.randn(
+        (batch,) + tuple(input.shape[1:]), dtype=input.dtype, device=input.device
+    ).contiguous(memory_format=memory_format(input))
+    kwargs = dict(kwargs)
+
+    if 'plans' in kwargs:
+        kwargs['plans'] = {}
+
+    return (input,) + tuple(args[1:]), kwargs
+
+
+def resident_memory(field):
+    # a size field of /proc/self/status (VmRSS, VmHWM, ...) in bytes
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1]) * 1024
+
+
+def cpu_peak_memory(run):
+    # Peak resident memory that run adds, from the kernel's high-water mark,
+    # which writing 5 to clear_refs resets to the current size. Tensors big
+    # enough to matter are mmapped and unmapped on free, so this tracks their
+    # allocations. None without Linux's /proc.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+
+    except OSError:
+        return None
+
+    base = resident_memory('VmRSS')
+    run()
+
+    return resident_memory('VmHWM') - base
+
+
+def time_call(fn, args, kwargs, mode, repeat):
+    input = args[0].detach().requires_grad_(mode != 'forward')
+    args = (input,) + tuple(args[1:])
+    device = input.device
+
+    with torch.no_grad():
+        out = fn(*args, **kwargs)
+
+    # double backward differentiates the input gradient with respect to
+    # grad_output, which is what carries the graph for linear ops like upfirdn2d
+    grad_output = torch.randn_like(out).requires_grad_(mode == 'double_backward')
+
+    if mode == 'forward':
+        def run():
+            with torch.no_grad():
+                fn(*args, **kwargs)
+
+    elif mode == 'backward':
+        def run():
+            fn(*args, **kwargs).backward(grad_output)
+            input.grad = None
+
+    else:
+        def run():
+            grad, = autograd.grad(fn(*args, **kwargs), input, grad_output, create_graph=True)
+            grad.pow(2).sum().backward()
+            input.grad = grad_output.grad = None
+
+    peak = None
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        run()
+        torch.cuda.synchronize(device)
+        peak = torch.cuda.max_memory_allocated(device) - base
+
+    elif device.type == 'cpu':
+        peak = cpu_peak_memory(run)
+
+    seconds = registry.benchmark(run, device, repeat)
+
+    # bytes read and written by the forward op itself
+    traffic = (input.numel() + out.numel()) * input.element_size()
+
+    return {
+        f'{mode}_ms': seconds * 1e3,
+        f'{mode}_peak_memory': peak,
+        f'{mode}_gbps': traffic / seconds / 1e9 if mode == 'forward' else None,
+    }
+
+
+def run_benchmark(
+    sizes=(256, 512, 1024),
+    batch=4,
+    device='cuda',
+    dtype=torch.float32,
+    modes=('forward', 'backward', 'double_backward'),
+    variants=None,
+    repeat=10,
+    channel_multiplier=2,
+    channels_last=False,
+):
+    device = torch.device(device)
+    results = []
+
+    for size in sizes:
+        for model_name, calls in model_calls(
+            size, device, channel_multiplier, channels_last
+        ).items():
+            for call, (args, kwargs) in calls.items():
+                op, key = call
+                args, kwargs = call_inputs(args, kwargs, batch)
+
+                if dtype != args[0].dtype:
+                    args = (args[0].to(dtype),) + args[1:]
+
+                for name in registry.variants(op, *args, **kwargs):
+                    if variants is not None and name not in variants:
+                        continue
+
+                    fn = registry.variant(op, name)
+                    record = {
+                        'model': model_name,
+                        'size': size,
+                        'op': op,
+                        'shape': list(args[0].shape),
+                        'dtype': str(args[0].dtype),
+                        'memory_format': key[3],
+                        'params': list(key[4:]),
+                        'variant': name,
+                    }
+
+                    for mode in modes:
+                        try:
+                            record.update(time_call(fn, args, kwargs, mode, repeat))
+
+                        except Exception as e:
+                            logger.warning('%s %s %s: %s failed (%s)', op, record['shape'], name, mode, e)
+                            record[f'{mode}_error'] = str(e)
+
+                    results.append(record)
+
+    return {
+        'machine': registry.machine(device),
+        'batch': batch,
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--size', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--dtype', type=str, default='float32', choices=['float32', 'float16', 'bfloat16'])
+    parser.add_argument('--mode', type=str, nargs='+', default=['forward', 'backward', 'double_backward'])
+    parser.add_argument('--variant', type=str, nargs='+', default=None, help='only these variants')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--channels_last', action='store_true')
+    parser.add_argument('--out', type=str, default='op_benchmark.json')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    report = run_benchmark(
+        sizes=args.size,
+        batch=args.batch,
+        device=args.device,
+        dtype=getattr(torch, args.dtype),
+        modes=args.mode,
+        variants=args.variant,
+        repeat=args.repeat,
+        channel_multiplier=args.channel_multiplier,
+        channels_last=args.channels_last,
+    )
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    for record in report['results']:
+        timings = ', '.join(
+            f'{mode} {record[f"{mode}_ms"]:.3f}ms' for mode in args.mode if f'{mode}_ms' in record
+        )
+        print(f'{record["model"]} {record["size"]} {record["op"]} {record["shape"]} {record["variant"]}: {timings}')
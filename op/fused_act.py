@@ -1,19 +1,12 @@
-import os
-
 import torch
 from torch import nn
 from torch.autograd import Function
-from torch.utils.cpp_extension import load
+
+from .loader import LazyExtension
 
 
-module_path = os.path.dirname(__file__)
-fused = load(
-    'fused',
-    sources=[
-        os.path.join(module_path, 'fused_bias_act.cpp'),
-        os.path.join(module_path, 'fused_bias_act_kernel.cu'),
-    ],
-)
+# built (or loaded from the cache) on first use, see loader.py
+fused = LazyExtension('fused')
 
 
 class FusedLeakyReLUFunctionBackward(Function):
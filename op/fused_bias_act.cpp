@@ -1,8 +1,13 @@
 #include <torch/extension.h>
 
 
+torch::Tensor fused_bias_act_op_cpu(const torch::Tensor& input, const torch::Tensor& bias, const torch::Tensor& refer,
+    int act, int grad, float alpha, float scale);
+
+#ifdef WITH_CUDA
 torch::Tensor fused_bias_act_op(const torch::Tensor& input, const torch::Tensor& bias, const torch::Tensor& refer,
     int act, int grad, float alpha, float scale);
+#endif
 
 #define CHECK_CUDA(x) TORCH_CHECK(x.type().is_cuda(), #x " must be a CUDA tensor")
 #define CHECK_CONTIGUOUS(x) TORCH_CHECK(x.is_contiguous(), #x " must be contiguous")
@@ -10,12 +15,24 @@ torch::Tensor fused_bias_act_op(const torch::Tensor& input, const torch::Tensor&
 
 torch::Tensor fused_bias_act(const torch::Tensor& input, const torch::Tensor& bias, const torch::Tensor& refer,
     int act, int grad, float alpha, float scale) {
-    CHECK_CUDA(input);
-    CHECK_CUDA(bias);
+    if (input.is_cuda()) {
+#ifdef WITH_CUDA
+        CHECK_CUDA(bias);
 
-    return fused_bias_act_op(input, bias, refer, act, grad, alpha, scale);
+        return fused_bias_act_op(input, bias, refer, act, grad, alpha, scale);
+#else
+        TORCH_CHECK(false, "fused_bias_act was built without CUDA support");
+#endif
+    }
+
+    return fused_bias_act_op_cpu(input, bias, refer, act, grad, alpha, scale);
 }
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
-    m.def("fused_bias_act", &fused_bias_act, "fused bias act (CUDA)");
-}
\ No newline at end of file
+    m.def("fused_bias_act", &fused_bias_act, "fused bias act (CPU/CUDA)");
+#ifdef WITH_CUDA
+    m.attr("with_cuda") = true;
+#else
+    m.attr("with_cuda") = false;
+#endif
+}
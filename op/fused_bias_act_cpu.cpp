@@ -0,0 +1,113 @@
+#include <torch/extension.h>
+
+#include <ATen/OpMathType.h>
+#include <ATen/Parallel.h>
+
+#include <algorithm>
+
+
+// Same modes as fused_bias_act_kernel. The input is walked one bias "row"
+// (all the elements of one channel of one sample) per OpenMP iteration, so the
+// bias is a constant in the vectorised inner loop.
+template <typename scalar_t>
+static void fused_bias_act_cpu_kernel(scalar_t* out, const scalar_t* p_x, const scalar_t* p_b, const scalar_t* p_ref,
+    int act, int grad, float alpha, float scale, int64_t size_x, int64_t step_b, int64_t size_b, int use_bias, int use_ref) {
+    using opmath_t = at::opmath_type<scalar_t>;
+
+    const opmath_t a = alpha;
+    const opmath_t s = scale;
+    const int64_t rows = size_x / step_b;
+
+#pragma omp parallel for num_threads(at::get_num_threads()) schedule(static)
+    for (int64_t row = 0; row < rows; row++) {
+        const opmath_t b = use_bias ? static_cast<opmath_t>(p_b[row % size_b]) : opmath_t(0);
+        const scalar_t* x = p_x + row * step_b;
+        const scalar_t* ref = p_ref + row * step_b;
+        scalar_t* y = out + row * step_b;
+
+        switch (act * 10 + grad) {
+            default:
+            case 10:
+            case 11:
+#pragma omp simd
+                for (int64_t i = 0; i < step_b; i++) {
+                    y[i] = static_cast<scalar_t>((static_cast<opmath_t>(x[i]) + b) * s);
+                }
+                break;
+
+            case 30:
+#pragma omp simd
+                for (int64_t i = 0; i < step_b; i++) {
+                    opmath_t v = static_cast<opmath_t>(x[i]) + b;
+                    y[i] = static_cast<scalar_t>((v > 0 ? v : v * a) * s);
+                }
+                break;
+
+            case 31:
+                if (use_ref) {
+#pragma omp simd
+                    for (int64_t i = 0; i < step_b; i++) {
+                        opmath_t v = static_cast<opmath_t>(x[i]) + b;
+                        y[i] = static_cast<scalar_t>((static_cast<opmath_t>(ref[i]) > 0 ? v : v * a) * s);
+                    }
+                }
+                else {
+#pragma omp simd
+                    for (int64_t i = 0; i < step_b; i++) {
+                        y[i] = static_cast<scalar_t>((static_cast<opmath_t>(x[i]) + b) * a * s);
+                    }
+                }
+                break;
+
+            case 12:
+            case 32:
+                std::fill(y, y + step_b, static_cast<scalar_t>(0));
+                break;
+        }
+    }
+}
+
+
+torch::Tensor fused_bias_act_op_cpu(const torch::Tensor& input, const torch::Tensor& bias, const torch::Tensor& refer,
+    int act, int grad, float alpha, float scale) {
+    auto x = input.contiguous();
+    auto b = bias.to(x.scalar_type()).contiguous();
+    auto ref = refer.contiguous();
+
+    int use_bias = b.numel() ? 1 : 0;
+    int use_ref = ref.numel() ? 1 : 0;
+
+    int64_t size_x = x.numel();
+    int64_t size_b = b.numel();
+    int64_t step_b = 1;
+
+    for (int i = 1 + 1; i < x.dim(); i++) {
+        step_b *= x.size(i);
+    }
+
+    auto y = torch::empty_like(x);
+
+    if (size_x == 0) {
+        return y;
+    }
+
+    AT_DISPATCH_FLOATING_TYPES_AND(at::ScalarType::BFloat16, x.scalar_type(), "fused_bias_act_cpu", [&] {
+        fused_bias_act_cpu_kernel<scalar_t>(
+            y.data_ptr<scalar_t>(),
+            x.data_ptr<scalar_t>(),
+            b.data_ptr<scalar_t>(),
+            ref.data_ptr<scalar_t>(),
+            act,
+            grad,
+            alpha,
+            scale,
+            size_x,
+            step_b,
+            size_b,
+            use_bias,
+            use_ref
+        );
+    });
+
+    return y;
+}
@@ -0,0 +1,148 @@
+import hashlib
+import importlib
+import logging
+import os
+import shutil
+
+import torch
+from torch.utils import cpp_extension
+
+
+logger = logging.getLogger(__name__)
+
+module_path = os.path.dirname(__file__)
+
+# extension name -> (C++ sources, CUDA sources)
+EXTENSIONS = {
+    'upfirdn2d': (['upfirdn2d.cpp', 'upfirdn2d_cpu.cpp'], ['upfirdn2d_kernel.cu']),
+    'fused': (['fused_bias_act.cpp', 'fused_bias_act_cpu.cpp'], ['fused_bias_act_kernel.cu']),
+}
+
+extra_cflags = ['-O3', '-fopenmp']
+extra_ldflags = ['-fopenmp']
+
+_loaded = {}
+
+
+def cuda_toolkit_available():
+    return cpp_extension.CUDA_HOME is not None
+
+
+def extension_sources(name, with_cuda):
+    cpp_sources, cuda_sources = EXTENSIONS[name]
+
+    if with_cuda:
+        cpp_sources = cpp_sources + cuda_sources
+
+    return [os.path.join(module_path, source) for source in cpp_sources]
+
+
+def user_cache_dir():
+    cache_home = os.environ.get(
+        'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')
+    )
+
+    return os.path.join(cache_home, 'pir')
+
+
+def cache_dir():
+    root = os.environ.get('PIR_EXTENSIONS_DIR')
+
+    if root is None:
+        root = os.path.join(user_cache_dir(), 'extensions')
+
+    return root
+
+
+def source_hash(sources, with_cuda):
+    # rebuild whenever a source, the torch build or the CUDA setting changes
+    digest = hashlib.sha1()
+
+    for source in sources:
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+
+    digest.update(torch.__version__.encode())
+    digest.update(str(torch.version.cuda).encode())
+    digest.update(str(with_cuda).encode())
+
+    return digest.hexdigest()[:16]
+
+
+def load_prebuilt(name, with_cuda):
+    # modules built ahead of time by op/setup.py live next to this file as _<name>
+    try:
+        module = importlib.import_module(f'._{name}', __package__)
+
+    except ImportError:
+        return None
+
+    if with_cuda and not module.with_cuda:
+        return None
+
+    return module
+
+
+def build(name, with_cuda):
+    if shutil.which(os.environ.get('CXX', 'c++')) is None:
+        logger.info('%s: no C++ compiler found, not building the extension', name)
+
+        return None
+
+    if not cpp_extension.is_ninja_available():
+        logger.info('%s: ninja is not installed, not building the extension', name)
+
+        return None
+
+    sources = extension_sources(name, with_cuda)
+    build_name = f'{name}_{source_hash(sources, with_cuda)}'
+    build_directory = os.path.join(cache_dir(), build_name)
+    os.makedirs(build_directory, exist_ok=True)
+
+    cflags = extra_cflags + (['-DWITH_CUDA'] if with_cuda else [])
+
+    try:
+        return cpp_extension.load(
+            build_name,
+            sources=sources,
+            extra_cflags=cflags,
+            extra_ldflags=extra_ldflags,
+            build_directory=build_directory,
+        )
+
+    except Exception as e:
+        logger.warning('%s: building the extension failed (%s)', name, e)
+
+        return None
+
+
+def load_extension(name):
+    # the compiled module, or None if it is not prebuilt and can't be built here;
+    # CUDA kernels are included whenever this process can use them
+    if name in _loaded:
+        return _loaded[name]
+
+    with_cuda = torch.cuda.is_available() and cuda_toolkit_available()
+    module = load_prebuilt(name, with_cuda)
+
+    if module is None:
+        module = build(name, with_cuda)
+
+    _loaded[name] = module
+
+    return module
+
+
+class LazyExtension:
+    # stands in for the extension module and loads it on first attribute access
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        module = load_extension(self.name)
+
+        if module is None:
+            raise RuntimeError(f'the {self.name} extension is not available')
+
+        return getattr(module, attr)
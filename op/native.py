@@ -0,0 +1,456 @@
+import torch
+from torch import nn
+import torch.nn.functional as F
+from torch.autograd import Function
+
+
+class FusedLeakyReLU(nn.Module):
+    def __init__(self, channel, negative_slope=0.2, scale=2 ** 0.5):
+        super().__init__()
+
+        self.bias = nn.Parameter(torch.zeros(channel))
+        self.negative_slope = negative_slope
+        self.scale = scale
+
+
+    def forward(self, input):
+        return fused_leaky_relu(input, self.bias, self.negative_slope, self.scale)
+
+
+def fused_leaky_relu(input, bias, negative_slope=0.2, scale=2 ** 0.5):
+    # print(input.shape, bias.shape,bias.view((1, -1) + (1,) * (len(input.shape) - 2)).shape)
+    bias = bias.to(input.dtype)
+
+    return scale * F.leaky_relu(input + bias.view((1, -1) + (1,) * (len(input.shape) - 2)),
+                                negative_slope=negative_slope)
+
+
+class FusedNoiseLeakyReLUFunctionBackward(Function):
+    # the gradient of scale * leaky_relu(z) is grad_output * scale where z > 0 and
+    # grad_output * scale * negative_slope elsewhere; the output has the same sign
+    # as z, so it is all that needs to be kept
+    @staticmethod
+    def forward(ctx, grad_output, out, negative_slope, scale):
+        ctx.save_for_backward(out)
+        ctx.negative_slope = negative_slope
+        ctx.scale = scale
+
+        return leaky_relu_grad(grad_output, out, negative_slope, scale)
+
+    @staticmethod
+    def backward(ctx, gradgrad_input):
+        out, = ctx.saved_tensors
+        gradgrad_out = leaky_relu_grad(gradgrad_input, out, ctx.negative_slope, ctx.scale)
+
+        return gradgrad_out, None, None, None
+
+
+class FusedNoiseLeakyReLUFunction(Function):
+    @staticmethod
+    def forward(ctx, input, noise, noise_weight, bias, negative_slope, scale):
+        # the parameters are cast so a bfloat16 input stays bfloat16
+        out = input + bias.to(input.dtype).view((1, -1) + (1,) * (input.ndim - 2))
+        out.add_(noise * noise_weight)
+        F.leaky_relu(out, negative_slope=negative_slope, inplace=True)
+        out.mul_(scale)
+
+        ctx.save_for_backward(out, noise, noise_weight)
+        ctx.negative_slope = negative_slope
+        ctx.scale = scale
+
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        out, noise, noise_weight = ctx.saved_tensors
+
+        grad_input = FusedNoiseLeakyReLUFunctionBackward.apply(
+            grad_output, out, ctx.negative_slope, ctx.scale
+        )
+
+        grad_noise = grad_noise_weight = grad_bias = None
+
+        if ctx.needs_input_grad[1]:
+            grad_noise = (grad_input * noise_weight).sum(1, keepdim=True)
+
+            if noise.shape[0] == 1:
+                grad_noise = grad_noise.sum(0, keepdim=True)
+
+        if ctx.needs_input_grad[2]:
+            grad_noise_weight = (grad_input * noise).sum().view_as(noise_weight)
+
+        if ctx.needs_input_grad[3]:
+            grad_bias = grad_input.sum([0] + list(range(2, grad_input.ndim)))
+
+        return grad_input, grad_noise, grad_noise_weight, grad_bias, None, None
+
+
+def exporting():
+    # True while a graph for export is being built, by TorchScript tracing (and
+    # the ONNX exporter based on it) or by torch.export (the dynamo ONNX exporter)
+    if torch.jit.is_tracing():
+        return True
+
+    compiler = getattr(torch, 'compiler', None)
+
+    return compiler is not None and hasattr(compiler, 'is_exporting') and compiler.is_exporting()
+
+
+def leaky_relu_grad(grad_output, out, negative_slope, scale):
+    return grad_output * torch.where(
+        out > 0, grad_output.new_tensor(scale), grad_output.new_tensor(scale * negative_slope)
+    )
+
+
+def fused_noise_leaky_relu(input, noise, noise_weight, bias, negative_slope=0.2, scale=2 ** 0.5):
+    # scale * leaky_relu(input + noise_weight * noise + bias), the NoiseInjection and
+    # FusedLeakyReLU of StyledConv in one pass that only keeps its output for backward
+    if exporting():
+        # graphs for export get the plain ops rather than an opaque Python Function
+        out = input + bias.to(input.dtype).view((1, -1) + (1,) * (input.ndim - 2))
+        out = out + noise * noise_weight
+
+        return F.leaky_relu(out, negative_slope=negative_slope) * scale
+
+    return FusedNoiseLeakyReLUFunction.apply(
+        input, noise, noise_weight, bias, negative_slope, scale
+    )
+
+
+def fused_noise_leaky_relu_(
+    input, noise, noise_weight, bias, negative_slope=0.2, scale=2 ** 0.5
+):
+    # fused_noise_leaky_relu written into input, for inference without autograd
+    input.add_(bias.to(input.dtype).view((1, -1) + (1,) * (input.ndim - 2)))
+    input.addcmul_(noise, noise_weight.to(input.dtype))
+    F.leaky_relu_(input, negative_slope)
+
+    return input.mul_(scale)
+
+
+def upfirdn2d_native(
+    input, kernel, up_x, up_y, down_x, down_y, pad_x0, pad_x1, pad_y0, pad_y1
+):
+    input = input.permute(0, 2, 3, 1)
+    _, in_h, in_w, minor = input.shape
+    kernel_h, kernel_w = kernel.shape
+    out = input.view(-1, in_h, 1, in_w, 1, minor)
+    out = F.pad(out, [0, 0, 0, up_x - 1, 0, 0, 0, up_y - 1])
+    out = out.view(-1, in_h * up_y, in_w * up_x, minor)
+
+    out = F.pad(
+        out, [0, 0, max(pad_x0, 0), max(pad_x1, 0), max(pad_y0, 0), max(pad_y1, 0)]
+    )
+    out = out[
+        :,
+        max(-pad_y0, 0) : out.shape[1] - max(-pad_y1, 0),
+        max(-pad_x0, 0) : out.shape[2] - max(-pad_x1, 0),
+        :,
+    ]
+
+    out = out.permute(0, 3, 1, 2)
+    out = out.reshape(
+        [-1, 1, in_h * up_y + pad_y0 + pad_y1, in_w * up_x + pad_x0 + pad_x1]
+    )
+    w = torch.flip(kernel, [0, 1]).view(1, 1, kernel_h, kernel_w)
+    out = F.conv2d(out, w)
+    out = out.reshape(
+        -1,
+        minor,
+        in_h * up_y + pad_y0 + pad_y1 - kernel_h + 1,
+        in_w * up_x + pad_x0 + pad_x1 - kernel_w + 1,
+    )
+    # out = out.permute(0, 2, 3, 1)
+    return out[:, :, ::down_y, ::down_x]
+
+
+def memory_format(input):
+    # torch.channels_last for NHWC-strided 4-D tensors, torch.contiguous_format
+    # otherwise (including tensors where the two coincide)
+    if (
+        input.dim() == 4
+        and not input.is_contiguous()
+        and input.is_contiguous(memory_format=torch.channels_last)
+    ):
+        return torch.channels_last
+
+    return torch.contiguous_format
+
+
+def pixel_shuffle(input, up):
+    # F.pixel_shuffle that keeps a channels_last input channels_last
+    if memory_format(input) != torch.channels_last:
+        return F.pixel_shuffle(input, up)
+
+    batch, channel, height, width = input.shape
+    channel //= up * up
+
+    out = torch.empty(
+        batch,
+        channel,
+        height * up,
+        width * up,
+        dtype=input.dtype,
+        device=input.device,
+        memory_format=torch.channels_last,
+    )
+    out.view(batch, channel, height, up, width, up).copy_(
+        input.view(batch, channel, up, up, height, width).permute(0, 1, 4, 2, 5, 3)
+    )
+
+    return out
+
+
+def polyphase_taps(kernel_size, up, pad0):
+    # splits a kernel of the given size into up phases; phase r computes the
+    # outputs r, r + up, r + 2 * up, ... from the taps flipped_kernel[first::up]
+    # applied to the input starting at offset. Also returns the input window
+    # [lo, hi] that covers every phase.
+    phases = []
+
+    for r in range(up):
+        first = (pad0 - r) % up
+        offset = (r + first - pad0) // up
+        phases.append((first, offset))
+
+    lo = min(offset for _, offset in phases)
+    hi = max(
+        offset + len(range(first, kernel_size, up)) - 1 for first, offset in phases
+    )
+
+    return phases, lo, hi
+
+
+def split_pad(pad):
+    # symmetric non-negative pads go to the convolution itself, anything else
+    # needs an explicit F.pad (negative amounts crop)
+    pad_x0, pad_x1, pad_y0, pad_y1 = pad
+
+    if pad_x0 == pad_x1 >= 0 and pad_y0 == pad_y1 >= 0:
+        return None, (pad_y0, pad_x0)
+
+    return list(pad), (0, 0)
+
+
+class UpFirDn2dPlan:
+    # Everything upfirdn2d needs for one (channel, height, width, dtype, device):
+    # the flipped kernel laid out as depthwise convolution weights, the pad
+    # amounts and the output size. Runs directly on [batch, channel, H, W], so
+    # the input keeps its layout and memory format.
+    #
+    # modes:
+    #   direct    - zero-stuff, pad and run one depthwise conv with the 2-D kernel
+    #   separable - two depthwise 1-D passes with kernel_1d, downsampling by stride
+    #   polyphase - up * up phases evaluated at input resolution, pixel_shuffled
+
+    def __init__(self, input, kernel, up, down, pad, kernel_1d=None, mode=None):
+        _, channel, in_h, in_w = input.shape
+        kernel_h, kernel_w = kernel.shape
+        pad_x0, pad_x1, pad_y0, pad_y1 = pad
+
+        if mode is None:
+            if up > 1 and kernel_h >= up and kernel_w >= up:
+                mode = 'polyphase'
+
+            elif kernel_1d is not None:
+                mode = 'separable'
+
+            else:
+                mode = 'direct'
+
+        self.mode = mode
+        self.channel = channel
+        self.up = up
+        self.down = down
+        self.kernel = kernel
+        self.kernel_1d = kernel_1d
+        self.in_size = (in_h, in_w)
+        self.pad_amounts = pad
+        self.transposed_plan = None
+        self.full_h = in_h * up + pad_y0 + pad_y1 - kernel_h + 1
+        self.full_w = in_w * up + pad_x0 + pad_x1 - kernel_w + 1
+        self.out_h = (self.full_h - 1) // down + 1
+        self.out_w = (self.full_w - 1) // down + 1
+
+        kernel = kernel.to(input)
+
+        if mode == 'polyphase':
+            phase_h = -(-self.full_h // up)
+            phase_w = -(-self.full_w // up)
+            phases_y, lo_y, hi_y = polyphase_taps(kernel_h, up, pad_y0)
+            phases_x, lo_x, hi_x = polyphase_taps(kernel_w, up, pad_x0)
+
+            flipped = torch.flip(kernel, [0, 1])
+            w = kernel.new_zeros(up * up, 1, hi_y - lo_y + 1, hi_x - lo_x + 1)
+
+            for r_y, (first_y, offset_y) in enumerate(phases_y):
+                for r_x, (first_x, offset_x) in enumerate(phases_x):
+                    taps = flipped[first_y::up, first_x::up]
+                    w[
+                        r_y * up + r_x,
+                        0,
+                        offset_y - lo_y : offset_y - lo_y + taps.shape[0],
+                        offset_x - lo_x : offset_x - lo_x + taps.shape[1],
+                    ] = taps
+
+            self.weight = w.repeat(channel, 1, 1, 1)
+            self.crop = (
+                phase_h * up != self.full_h or phase_w * up != self.full_w or down > 1
+            )
+            pad = (-lo_x, phase_w + hi_x - in_w, -lo_y, phase_h + hi_y - in_h)
+
+        elif mode == 'separable':
+            w = torch.flip(kernel_1d.to(input), [0])
+            self.weight_x = w.view(1, 1, 1, -1).repeat(channel, 1, 1, 1)
+            self.weight_y = w.view(1, 1, -1, 1).repeat(channel, 1, 1, 1)
+
+        else:
+            w = torch.flip(kernel, [0, 1]).view(1, 1, kernel_h, kernel_w)
+            self.weight = w.repeat(channel, 1, 1, 1)
+
+        self.pad, self.padding = split_pad(pad)
+
+    def __call__(self, input):
+        # autocast would run the convolutions below in its own dtype; the plan
+        # is built for the input's, and fp32 inputs (the RGB skip) stay fp32
+        with torch.autocast(input.device.type, enabled=False):
+            return self.run(input)
+
+    def run(self, input):
+        channel = self.channel
+
+        if self.mode != 'polyphase' and self.up > 1:
+            batch, _, in_h, in_w = input.shape
+
+            if memory_format(input) == torch.channels_last:
+                # the 6-D pad below would come back in NCHW
+                stuffed = torch.empty(
+                    batch,
+                    channel,
+                    in_h * self.up,
+                    in_w * self.up,
+                    dtype=input.dtype,
+                    device=input.device,
+                    memory_format=torch.channels_last,
+                )
+                stuffed.zero_()[:, :, :: self.up, :: self.up] = input
+                input = stuffed
+
+            else:
+                input = input.reshape(batch, channel, in_h, 1, in_w, 1)
+                input = F.pad(input, [0, self.up - 1, 0, 0, 0, self.up - 1])
+                input = input.view(batch, channel, in_h * self.up, in_w * self.up)
+
+        if self.pad is not None:
+            input = F.pad(input, self.pad)
+
+        if self.mode == 'polyphase':
+            out = F.conv2d(input, self.weight, padding=self.padding, groups=channel)
+            out = pixel_shuffle(out, self.up)
+
+            if self.crop:
+                out = out[:, :, : self.full_h : self.down, : self.full_w : self.down]
+
+        elif self.mode == 'separable':
+            pad_y, pad_x = self.padding
+            out = F.conv2d(
+                input, self.weight_x, stride=(1, self.down), padding=(0, pad_x), groups=channel
+            )
+            out = F.conv2d(
+                out, self.weight_y, stride=(self.down, 1), padding=(pad_y, 0), groups=channel
+            )
+
+        else:
+            out = F.conv2d(
+                input, self.weight, stride=self.down, padding=self.padding, groups=channel
+            )
+
+        return out
+
+    def transposed(self, grad_output):
+        # the plan of the gradient: upfirdn2d with the flipped kernel, up and down
+        # swapped and the pads chosen to give back the input size, as in
+        # UpFirDn2d.forward
+        if self.transposed_plan is None:
+            kernel_h, kernel_w = self.kernel.shape
+            in_h, in_w = self.in_size
+            pad_x0, _, pad_y0, _ = self.pad_amounts
+
+            g_pad_x0 = kernel_w - pad_x0 - 1
+            g_pad_y0 = kernel_h - pad_y0 - 1
+            g_pad_x1 = in_w * self.up - self.out_w * self.down + pad_x0 - self.up + 1
+            g_pad_y1 = in_h * self.up - self.out_h * self.down + pad_y0 - self.up + 1
+
+            kernel_1d = self.kernel_1d
+
+            if kernel_1d is not None:
+                kernel_1d = torch.flip(kernel_1d, [0])
+
+            self.transposed_plan = UpFirDn2dPlan(
+                grad_output,
+                torch.flip(self.kernel, [0, 1]),
+                self.down,
+                self.up,
+                (g_pad_x0, g_pad_x1, g_pad_y0, g_pad_y1),
+                kernel_1d,
+            )
+
+        return self.transposed_plan
+
+
+class UpFirDn2dNativeBackward(Function):
+    @staticmethod
+    def forward(ctx, grad_output, plan):
+        ctx.plan = plan
+
+        return plan.transposed(grad_output)(grad_output)
+
+    @staticmethod
+    def backward(ctx, gradgrad_input):
+        gradgrad_out = UpFirDn2dNative.apply(gradgrad_input, ctx.plan)
+
+        return gradgrad_out, None
+
+
+class UpFirDn2dNative(Function):
+    # upfirdn2d is linear in its input, so its gradient is the transposed op and the
+    # gradient of that is the op again. Nothing but the plan has to be kept for
+    # backward, and create_graph=True adds one node per call rather than the whole
+    # pad/conv/pixel_shuffle chain.
+    @staticmethod
+    def forward(ctx, input, plan):
+        ctx.plan = plan
+
+        return plan(input)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        grad_input = UpFirDn2dNativeBackward.apply(grad_output, ctx.plan)
+
+        return grad_input, None
+
+
+def upfirdn2d(
+    input, kernel, up=1, down=1, pad=(0, 0), kernel_1d=None, plans=None, mode=None
+):
+    # plans caches an UpFirDn2dPlan per input shape; modules with a fixed kernel
+    # keep one dict for their lifetime so the plan is only built once. mode forces
+    # one of the UpFirDn2dPlan modes.
+    pad = (pad[0], pad[1], pad[0], pad[1])
+
+    if plans is None:
+        plan = UpFirDn2dPlan(input, kernel, up, down, pad, kernel_1d, mode)
+
+    else:
+        key = (input.shape[1:], input.dtype, input.device, mode)
+        plan = plans.get(key)
+
+        if plan is None:
+            plan = UpFirDn2dPlan(input, kernel, up, down, pad, kernel_1d, mode)
+            plans[key] = plan
+
+    if exporting():
+        # graphs for export get the plan's ops rather than an opaque Python Function
+        return plan.run(input)
+
+    return UpFirDn2dNative.apply(input, plan)
@@ -0,0 +1,283 @@
+import contextlib
+import json
+import logging
+import os
+import platform
+import time
+
+import torch
+
+from .loader import user_cache_dir
+from .native import exporting
+
+
+logger = logging.getLogger(__name__)
+
+# op -> (key, default): key(*args, **kwargs) names the shape/dtype/device/parameters
+# of a call, default(*args, **kwargs) picks the variant for calls that were never tuned
+_ops = {}
+
+# op -> {variant name: (fn, available)}, in registration order
+_variants = {}
+
+# (op, key) -> tuned variant name, or None when the call was never tuned
+_choices = {}
+
+# contents of the JSON cache, {machine: {repr((op, key)): variant name}}
+_cache = None
+_machines = {}
+
+# (op, key) -> (args, kwargs) of the first call with that key, while recording
+_recording = None
+
+
+def register_op(op, key, default):
+    _ops[op] = (key, default)
+    _variants.setdefault(op, {})
+
+
+def register(op, name, available=None):
+    # available(*args, **kwargs) says whether the variant can run a given call
+    def decorator(fn):
+        _variants[op][name] = (fn, available)
+
+        return fn
+
+    return decorator
+
+
+def variant(op, name):
+    return _variants[op][name][0]
+
+
+def variants(op, *args, **kwargs):
+    names = []
+
+    for name, (_, available) in _variants[op].items():
+        if available is None or available(*args, **kwargs):
+            names.append(name)
+
+    return names
+
+
+def dispatch(op, *args, **kwargs):
+    if exporting():
+        # graphs for export (TorchScript tracing, ONNX) can only hold plain torch
+        # ops, which is what the native variants are
+        return variant(op, 'native')(*args, **kwargs)
+
+    key, default = _ops[op]
+    call = (op, key(*args, **kwargs))
+
+    if _recording is not None and call not in _recording:
+        _recording[call] = (args, kwargs)
+
+    if call in _choices:
+        name = _choices[call]
+
+    else:
+        name = lookup(call, *args, **kwargs)
+        _choices[call] = name
+
+    if name is None:
+        name = default(*args, **kwargs)
+
+    return variant(op, name)(*args, **kwargs)
+
+
+def cache_path():
+    return os.environ.get(
+        'PIR_AUTOTUNE_CACHE', os.path.join(user_cache_dir(), 'autotune.json')
+    )
+
+
+def machine(device):
+    # tuned choices only carry over to the same device model, thread count and
+    # torch build
+    if device not in _machines:
+        if device.type == 'cuda':
+            name = torch.cuda.get_device_name(device)
+
+        else:
+            name = cpu_name()
+            name = f'{name} x{torch.get_num_threads()}'
+
+        _machines[device] = f'{device.type}:{name} torch {torch.__version__}'
+
+    return _machines[device]
+
+
+def cpu_name():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+
+    except OSError:
+        pass
+
+    return platform.processor() or platform.machine()
+
+
+def load_cache():
+    global _cache
+
+    if _cache is None:
+        _cache = {}
+
+        try:
+            with open(cache_path()) as f:
+                _cache = json.load(f)
+
+        except (OSError, ValueError):
+            pass
+
+    return _cache
+
+
+def save_cache():
+    path = cache_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # written to a temporary file first so concurrent runs never see half a file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump(load_cache(), f, indent=1, sort_keys=True)
+
+    os.replace(tmp_path, path)
+
+
+def lookup(call, *args, **kwargs):
+    # the cached choice for call, if that variant can still run it here
+    name = load_cache().get(machine(args[0].device), {}).get(repr(call))
+
+    if name is not None and name not in variants(call[0], *args, **kwargs):
+        return None
+
+    return name
+
+
+@contextlib.contextmanager
+def record():
+    # collects the distinct calls made inside the block, see autotune
+    global _recording
+
+    previous = _recording
+    _recording = calls = {}
+
+    try:
+        yield calls
+
+    finally:
+        _recording = previous
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def benchmark(fn, device, repeat=10, warmup=3):
+    # best of three batches of repeat calls, in seconds per call
+    for _ in range(warmup):
+        fn()
+
+    best = float('inf')
+
+    for _ in range(3):
+        synchronize(device)
+        start = time.perf_counter()
+
+        for _ in range(repeat):
+            fn()
+
+        synchronize(device)
+        best = min(best, (time.perf_counter() - start) / repeat)
+
+    return best
+
+
+def time_variant(fn, args, kwargs, backward, repeat):
+    input = args[0]
+
+    if not backward:
+        def run():
+            with torch.no_grad():
+                fn(*args, **kwargs)
+
+        return benchmark(run, input.device, repeat)
+
+    input = input.detach().requires_grad_()
+    args = (input,) + tuple(args[1:])
+
+    with torch.no_grad():
+        grad_output = torch.randn_like(fn(*args, **kwargs))
+
+    def run():
+        fn(*args, **kwargs).backward(grad_output)
+        input.grad = None
+
+    return benchmark(run, input.device, repeat)
+
+
+def autotune(run, backward=False, repeat=10, save=True):
+    """Picks the fastest variant of every op call made by run().
+
+    run is called once to collect the calls (op, input shape, dtype, device and
+    op parameters); each is then timed with every available variant, forward
+    only or forward and backward, and the winner is used for that call from then
+    on. The choices are stored in the JSON file at cache_path(), per machine,
+    so later runs reuse them without tuning again.
+
+    Returns {(op, key): (variant name, {variant name: seconds per call})}.
+    """
+
+    with record() as calls:
+        with torch.no_grad():
+            run()
+
+    results = {}
+
+    for call, (args, kwargs) in calls.items():
+        op = call[0]
+        timings = {}
+
+        for name in variants(op, *args, **kwargs):
+            fn = variant(op, name)
+
+            try:
+                timings[name] = time_variant(fn, args, kwargs, backward, repeat)
+
+            except Exception as e:
+                logger.warning('%s: the %s variant failed (%s)', op, name, e)
+
+        if not timings:
+            continue
+
+        best = min(timings, key=timings.get)
+        _choices[call] = best
+        load_cache().setdefault(machine(args[0].device), {})[repr(call)] = best
+        results[call] = (best, timings)
+
+        logger.info(
+            '%s %s: %s (%s)',
+            op,
+            call[1],
+            best,
+            ', '.join(f'{name} {t * 1e6:.1f}us' for name, t in timings.items()),
+        )
+
+    if save and results:
+        save_cache()
+
+    return results
+
+
+def reset():
+    # forgets the tuned choices of this process; the JSON cache is left alone
+    global _cache
+
+    _choices.clear()
+    _cache = None
@@ -0,0 +1,45 @@
+# Ahead-of-time build of the op/ extensions, so nothing is compiled on first use:
+#
+#     python op/setup.py build_ext --inplace
+#
+# The CUDA kernels are included when a CUDA toolkit is found, otherwise only the
+# CPU kernels are built. loader.load_extension picks up the resulting
+# op/_upfirdn2d and op/_fused modules before falling back to a JIT build.
+import os
+
+from setuptools import setup
+from torch.utils.cpp_extension import BuildExtension, CppExtension, CUDAExtension
+
+from loader import (
+    EXTENSIONS,
+    cuda_toolkit_available,
+    extension_sources,
+    extra_cflags,
+    extra_ldflags,
+)
+
+
+module_path = os.path.dirname(os.path.abspath(__file__))
+with_cuda = cuda_toolkit_available()
+
+ext_modules = []
+
+for name in EXTENSIONS:
+    extension = CUDAExtension if with_cuda else CppExtension
+    cflags = extra_cflags + (['-DWITH_CUDA'] if with_cuda else [])
+
+    ext_modules.append(
+        extension(
+            f'op._{name}',
+            extension_sources(name, with_cuda),
+            extra_compile_args={'cxx': cflags, 'nvcc': []},
+            extra_link_args=extra_ldflags,
+        )
+    )
+
+setup(
+    name='pir-op',
+    package_dir={'op': module_path},
+    ext_modules=ext_modules,
+    cmdclass={'build_ext': BuildExtension},
+)
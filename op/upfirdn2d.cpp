@@ -1,9 +1,15 @@
 #include <torch/extension.h>
 
 
+torch::Tensor upfirdn2d_op_cpu(const torch::Tensor& input, const torch::Tensor& kernel,
+                               int up_x, int up_y, int down_x, int down_y,
+                               int pad_x0, int pad_x1, int pad_y0, int pad_y1);
+
+#ifdef WITH_CUDA
 torch::Tensor upfirdn2d_op(const torch::Tensor& input, const torch::Tensor& kernel,
                             int up_x, int up_y, int down_x, int down_y,
                             int pad_x0, int pad_x1, int pad_y0, int pad_y1);
+#endif
 
 #define CHECK_CUDA(x) TORCH_CHECK(x.type().is_cuda(), #x " must be a CUDA tensor")
 #define CHECK_CONTIGUOUS(x) TORCH_CHECK(x.is_contiguous(), #x " must be contiguous")
@@ -12,12 +18,24 @@ torch::Tensor upfirdn2d_op(const torch::Tensor& input, const torch::Tensor& kern
 torch::Tensor upfirdn2d(const torch::Tensor& input, const torch::Tensor& kernel,
                         int up_x, int up_y, int down_x, int down_y,
                         int pad_x0, int pad_x1, int pad_y0, int pad_y1) {
-    CHECK_CUDA(input);
-    CHECK_CUDA(kernel);
+    if (input.is_cuda()) {
+#ifdef WITH_CUDA
+        CHECK_CUDA(kernel);
+
+        return upfirdn2d_op(input, kernel, up_x, up_y, down_x, down_y, pad_x0, pad_x1, pad_y0, pad_y1);
+#else
+        TORCH_CHECK(false, "upfirdn2d was built without CUDA support");
+#endif
+    }
 
-    return upfirdn2d_op(input, kernel, up_x, up_y, down_x, down_y, pad_x0, pad_x1, pad_y0, pad_y1);
+    return upfirdn2d_op_cpu(input, kernel, up_x, up_y, down_x, down_y, pad_x0, pad_x1, pad_y0, pad_y1);
 }
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
-    m.def("upfirdn2d", &upfirdn2d, "upfirdn2d (CUDA)");
-}
\ No newline at end of file
+    m.def("upfirdn2d", &upfirdn2d, "upfirdn2d (CPU/CUDA)");
+#ifdef WITH_CUDA
+    m.attr("with_cuda") = true;
+#else
+    m.attr("with_cuda") = false;
+#endif
+}
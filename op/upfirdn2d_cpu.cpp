@@ -0,0 +1,167 @@
+#include <torch/extension.h>
+
+#include <ATen/OpMathType.h>
+#include <ATen/Parallel.h>
+
+#include <algorithm>
+#include <vector>
+
+static inline int floor_div(int a, int b) {
+  int c = a / b;
+
+  if (c * b > a) {
+    c--;
+  }
+
+  return c;
+}
+
+static inline int ceil_div(int a, int b) { return -floor_div(-a, b); }
+
+static inline int gcd(int a, int b) {
+  while (b) {
+    int t = a % b;
+    a = b;
+    b = t;
+  }
+
+  return a;
+}
+
+struct UpFirDn2DKernelParams {
+  int up_x;
+  int up_y;
+  int down_x;
+  int down_y;
+  int pad_x0;
+  int pad_x1;
+  int pad_y0;
+  int pad_y1;
+
+  int major_dim;
+  int in_h;
+  int in_w;
+  int minor_dim;
+  int kernel_h;
+  int kernel_w;
+  int out_h;
+  int out_w;
+};
+
+// Same indexing as upfirdn2d_kernel_large, but one (major, minor) plane per
+// OpenMP iteration, accumulating a whole output row at a time. Output columns
+// out_x = phase + j * period share their kernel taps and read the input step_x
+// columns apart, so the innermost loop has a fixed stride and vectorises.
+template <typename scalar_t>
+static void upfirdn2d_cpu_kernel(scalar_t *out, const scalar_t *input,
+                                 const scalar_t *kernel,
+                                 const UpFirDn2DKernelParams p) {
+  using opmath_t = at::opmath_type<scalar_t>;
+
+  const int period = p.up_x / gcd(p.up_x, p.down_x);
+  const int step_x = period * p.down_x / p.up_x;
+  const int64_t planes = (int64_t)p.major_dim * p.minor_dim;
+  const int64_t x_py = (int64_t)p.in_w * p.minor_dim;
+
+#pragma omp parallel for num_threads(at::get_num_threads()) schedule(static)
+  for (int64_t plane = 0; plane < planes; plane++) {
+    const int major_idx = plane / p.minor_dim;
+    const int minor_idx = plane % p.minor_dim;
+
+    const scalar_t *x_plane =
+        &input[(int64_t)major_idx * p.in_h * x_py + minor_idx];
+    scalar_t *out_plane =
+        &out[(int64_t)major_idx * p.out_h * p.out_w * p.minor_dim + minor_idx];
+
+    std::vector<opmath_t> acc(p.out_w);
+
+    for (int out_y = 0; out_y < p.out_h; out_y++) {
+      std::fill(acc.begin(), acc.end(), opmath_t(0));
+
+      int mid_y = out_y * p.down_y + p.up_y - 1 - p.pad_y0;
+      int in_y = std::min(std::max(floor_div(mid_y, p.up_y), 0), p.in_h);
+      int h = std::min(std::max(floor_div(mid_y + p.kernel_h, p.up_y), 0),
+                       p.in_h) -
+              in_y;
+      int kernel_y = mid_y + p.kernel_h - (in_y + 1) * p.up_y;
+
+      for (int y = 0; y < h; y++) {
+        const scalar_t *x_row = &x_plane[(in_y + y) * x_py];
+        const scalar_t *k_row = &kernel[(kernel_y - y * p.up_y) * p.kernel_w];
+
+        for (int phase = 0; phase < period && phase < p.out_w; phase++) {
+          int mid_x = phase * p.down_x + p.up_x - 1 - p.pad_x0;
+          int in_x = floor_div(mid_x, p.up_x);
+          int w = floor_div(mid_x + p.kernel_w, p.up_x) - in_x;
+          int kernel_x = mid_x + p.kernel_w - (in_x + 1) * p.up_x;
+          int count = ceil_div(p.out_w - phase, period);
+
+          for (int x = 0; x < w; x++) {
+            // columns in_x + x + j * step_x that fall inside the input
+            int col = in_x + x;
+            int j0 = col < 0 ? ceil_div(-col, step_x) : 0;
+            int j1 = col < p.in_w
+                         ? std::min(count, floor_div(p.in_w - 1 - col, step_x) + 1)
+                         : 0;
+            opmath_t k = static_cast<opmath_t>(k_row[kernel_x - x * p.up_x]);
+            const scalar_t *x_p = &x_row[(int64_t)col * p.minor_dim];
+            opmath_t *acc_p = &acc[phase];
+
+#pragma omp simd
+            for (int j = j0; j < j1; j++) {
+              acc_p[j * period] +=
+                  static_cast<opmath_t>(x_p[(int64_t)j * step_x * p.minor_dim]) * k;
+            }
+          }
+        }
+      }
+
+      scalar_t *out_row = &out_plane[(int64_t)out_y * p.out_w * p.minor_dim];
+
+      for (int out_x = 0; out_x < p.out_w; out_x++) {
+        out_row[(int64_t)out_x * p.minor_dim] = static_cast<scalar_t>(acc[out_x]);
+      }
+    }
+  }
+}
+
+torch::Tensor upfirdn2d_op_cpu(const torch::Tensor &input,
+                               const torch::Tensor &kernel, int up_x, int up_y,
+                               int down_x, int down_y, int pad_x0, int pad_x1,
+                               int pad_y0, int pad_y1) {
+  UpFirDn2DKernelParams p;
+
+  auto x = input.contiguous();
+  auto k = kernel.to(x.scalar_type()).contiguous();
+
+  p.major_dim = x.size(0);
+  p.in_h = x.size(1);
+  p.in_w = x.size(2);
+  p.minor_dim = x.size(3);
+  p.kernel_h = k.size(0);
+  p.kernel_w = k.size(1);
+  p.up_x = up_x;
+  p.up_y = up_y;
+  p.down_x = down_x;
+  p.down_y = down_y;
+  p.pad_x0 = pad_x0;
+  p.pad_x1 = pad_x1;
+  p.pad_y0 = pad_y0;
+  p.pad_y1 = pad_y1;
+
+  p.out_h = (p.in_h * p.up_y + p.pad_y0 + p.pad_y1 - p.kernel_h + p.down_y) /
+            p.down_y;
+  p.out_w = (p.in_w * p.up_x + p.pad_x0 + p.pad_x1 - p.kernel_w + p.down_x) /
+            p.down_x;
+
+  auto out =
+      at::empty({p.major_dim, p.out_h, p.out_w, p.minor_dim}, x.options());
+
+  AT_DISPATCH_FLOATING_TYPES_AND(at::ScalarType::BFloat16, x.scalar_type(), "upfirdn2d_cpu", [&] {
+    upfirdn2d_cpu_kernel<scalar_t>(out.data_ptr<scalar_t>(),
+                                   x.data_ptr<scalar_t>(),
+                                   k.data_ptr<scalar_t>(), p);
+  });
+
+  return out;
+}
@@ -0,0 +1,344 @@
+# Post-training int8 quantization of a Generator for CPU serving:
+#
+#     python quantize.py --ckpt /path/to/model.pt --size 256
+#
+# calibrates the generator on sampled z and writes model.int8.pt next to the
+# checkpoint; generate.py --int8 (or load_quantized) then builds the int8 model
+# from the fp32 checkpoint and that file.
+#
+# The mapping network and the style affines are quantized dynamically (int8
+# weights, activations quantized per call). The modulated 3x3 convs that don't
+# resample run as static int8 convs: the style scales their input and the
+# demodulation their output, so the conv in between has one shared weight, and
+# its input and output scales come from calibration. The upsampling convs, the
+# ToRGBs, the blurs and the noise stay in float. Layers whose int8 output is
+# too far from the float one on the calibration samples, or that are named in
+# the fallback list, are left in float too.
+import argparse
+import copy
+import logging
+import math
+import os
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+from torch.ao import quantization
+from torch.ao.nn.quantized import Conv2d as QuantizedConv2d
+from torch.ao.nn.quantized import dynamic as nnqd
+
+from model import EqualLinear, Generator, StyledConv, load_model, unwrap_state_dict
+from op import fused_leaky_relu
+
+
+logger = logging.getLogger(__name__)
+
+
+def quantize_weight(weight):
+    # symmetric int8 per output channel
+    observer = quantization.default_per_channel_weight_observer()
+    observer(weight)
+    scale, zero_point = observer.calculate_qparams()
+
+    return torch.quantize_per_channel(
+        weight, scale.double(), zero_point.long(), 0, torch.qint8
+    )
+
+
+def check_device(module):
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        if tensor.device.type != 'cpu':
+            raise ValueError('the int8 layers only run on the CPU, move the generator there first')
+
+
+class DynamicQuantizedLinear(nn.Module):
+    # int8 stand-in for a frozen EqualLinear or the concatenated style affines;
+    # the weight is quantized once, the input on every call
+    def __init__(self, weight, bias=None, activation=None):
+        super().__init__()
+
+        out_dim, in_dim = weight.shape
+        fold_bias = activation is None and bias is not None
+
+        self.linear = nnqd.Linear(in_dim, out_dim, bias_=fold_bias, dtype=torch.qint8)
+        self.linear.set_weight_bias(
+            quantize_weight(weight.detach().float()),
+            bias.detach().float() if fold_bias else None,
+        )
+        self.activation = activation
+
+        if activation:
+            self.register_buffer('bias', bias.detach().float().clone())
+
+    @classmethod
+    def from_equal_linear(cls, linear):
+        # linear has to be frozen, so its weight and bias are the scaled ones
+        return cls(linear.weight, linear.bias, linear.activation)
+
+    def forward(self, input):
+        out = self.linear(input)
+
+        if self.activation:
+            out = fused_leaky_relu(out, self.bias)
+
+        return out
+
+
+class QuantizedModulatedConv2d(nn.Module):
+    # int8 stand-in for a frozen ModulatedConv2d without up or downsampling,
+    # computed as in ModulatedConv2d.forward_input_scaling. Without qparams it
+    # runs in float and observes the input and output ranges of the conv for
+    # calibration.
+    def __init__(self, conv, qparams=None):
+        super().__init__()
+
+        self.in_channel = conv.in_channel
+        self.out_channel = conv.out_channel
+        self.kernel_size = conv.kernel_size
+        self.padding = conv.padding
+        self.demodulate = conv.demodulate
+        self.modulation = conv.modulation
+
+        weight = conv.scaled_weight().detach().squeeze(0).float()
+
+        self.register_buffer('weight_norm', conv.weight_norm().detach().float().clone())
+        self.conv = None
+        self.error = None
+
+        if qparams is None:
+            activation = quantization.get_default_qconfig(
+                torch.backends.quantized.engine
+            ).activation
+            self.observers = nn.ModuleList([activation(), activation()])
+            self.register_buffer('weight', weight.clone())
+
+        else:
+            self.observers = None
+            self.quantize(weight, qparams)
+
+    def qparams(self):
+        # (input scale, input zero point, output scale, output zero point)
+        qparams = []
+
+        for observer in self.observers:
+            scale, zero_point = observer.calculate_qparams()
+            qparams += [float(scale), int(zero_point)]
+
+        return tuple(qparams)
+
+    def quantize(self, weight, qparams):
+        self.input_scale, self.input_zero_point, scale, zero_point = qparams
+
+        self.conv = QuantizedConv2d(
+            self.in_channel, self.out_channel, self.kernel_size, padding=self.padding, bias=False
+        )
+        self.conv.set_weight_bias(quantize_weight(weight), None)
+        self.conv.scale = scale
+        self.conv.zero_point = zero_point
+
+    def start_comparison(self):
+        # from here on forward also accumulates the error of the int8 conv
+        # against the float one, and passes the float output on, so every
+        # layer's error is measured on its own
+        self.quantize(self.weight, self.qparams())
+        self.error = [0.0, 0.0]
+
+    def snr(self):
+        # signal to quantization noise ratio over the comparison, in dB
+        error, energy = self.error
+
+        return 10 * math.log10(energy / max(error, 1e-30))
+
+    def forward(self, input, style, modulated=False):
+        batch = input.shape[0]
+
+        if not modulated:
+            style = self.modulation(style)
+
+        style = style.reshape(batch, self.in_channel).float()
+        input = input.float() * style.view(batch, self.in_channel, 1, 1)
+
+        if self.conv is None:
+            out = F.conv2d(input, self.weight, padding=self.padding)
+            self.observers[0](input)
+            self.observers[1](out)
+
+        else:
+            quantized = torch.quantize_per_tensor(
+                input, self.input_scale, self.input_zero_point, torch.quint8
+            )
+            out = self.conv(quantized).dequantize()
+
+            if self.error is not None:
+                reference = F.conv2d(input, self.weight, padding=self.padding)
+                self.error[0] += (out - reference).pow(2).sum().item()
+                self.error[1] += reference.pow(2).sum().item()
+                out = reference
+
+        if self.demodulate:
+            demod = torch.rsqrt(style.pow(2) @ self.weight_norm.t() + 1e-8)
+            out = out * demod.view(batch, self.out_channel, 1, 1)
+
+        return out
+
+
+def quantizable_convs(generator):
+    # {name: StyledConv} whose modulated conv can run as a static int8 conv
+    return {
+        name: module
+        for name, module in generator.named_modules()
+        if isinstance(module, StyledConv)
+        and not (module.conv.upsample or module.conv.downsample)
+    }
+
+
+def calibrate(generator, n_samples=256, batch=16, fallback=(), min_snr=30.0, seed=0):
+    """Calibrates the int8 convs of generator on n_samples random z.
+
+    The generator itself is left as it is; like the int8 layers, calibration
+    runs on the CPU. One pass over the samples observes the input and output
+    ranges of every quantizable conv; a second pass measures the signal to
+    quantization noise ratio of each int8 conv against the float one, and
+    convs below min_snr dB join the fallback list of layers that stay in
+    float. fallback can also name layers up front: StyledConvs
+    ('conv1', 'convs.1', ...), the mapping network's linears ('style.1' to
+    'style.8') and 'style_affine'.
+
+    Returns the calibration as a dict for quantize and torch.save.
+    """
+
+    check_device(generator)
+    generator = copy.deepcopy(generator).freeze_for_inference()
+    fallback = list(fallback)
+
+    convs = {
+        name: module
+        for name, module in quantizable_convs(generator).items()
+        if name not in fallback
+    }
+
+    for module in convs.values():
+        module.conv = QuantizedModulatedConv2d(module.conv)
+
+    def run():
+        # the same samples and noise on both passes, without touching the
+        # global RNG
+        with torch.random.fork_rng([]), torch.no_grad():
+            torch.manual_seed(seed)
+
+            for start in range(0, n_samples, batch):
+                generator([torch.randn(min(batch, n_samples - start), generator.style_dim)])
+
+    run()
+
+    for module in convs.values():
+        module.conv.start_comparison()
+
+    run()
+
+    snr = {name: module.conv.snr() for name, module in convs.items()}
+
+    for name, value in snr.items():
+        if value < min_snr:
+            logger.info('%s: %.1f dB below %.1f dB, kept in float', name, value, min_snr)
+            fallback.append(name)
+
+    return {
+        'qparams': {
+            name: module.conv.qparams()
+            for name, module in convs.items()
+            if name not in fallback
+        },
+        'fallback': fallback,
+        'snr': snr,
+    }
+
+
+def quantize(generator, calibration):
+    """Replaces the layers of generator by their int8 versions, in place, using
+    a calibration from calibrate made with the same weights. The generator is
+    frozen for inference first and has to be on the CPU.
+    """
+
+    check_device(generator)
+    generator.freeze_for_inference()
+    fallback = set(calibration['fallback'])
+
+    for i, layer in enumerate(generator.style):
+        if isinstance(layer, EqualLinear) and f'style.{i}' not in fallback:
+            generator.style[i] = DynamicQuantizedLinear.from_equal_linear(layer)
+
+    if 'style_affine' not in fallback:
+        weight, bias = generator.style_affine()
+        generator.quantized_affine = DynamicQuantizedLinear(weight, bias)
+
+    for name, qparams in calibration['qparams'].items():
+        module = generator.get_submodule(name)
+        module.conv = QuantizedModulatedConv2d(module.conv, qparams)
+
+    return generator
+
+
+def calibration_path(checkpoint):
+    # the calibration ships next to the fp32 checkpoint
+    root, _ = os.path.splitext(checkpoint)
+
+    return f'{root}.int8.pt'
+
+
+def load_quantized(generator, checkpoint, **kwargs):
+    # quantize with the calibration saved next to checkpoint, whose fp32 weights
+    # generator already holds; without one, calibrates here (kwargs go to
+    # calibrate) and does not save it
+    path = calibration_path(checkpoint)
+
+    if os.path.exists(path):
+        calibration = torch.load(path)
+
+    else:
+        logger.warning('%s not found, calibrating now; see quantize.py to save one', path)
+        calibration = calibrate(generator, **kwargs)
+
+    return quantize(generator, calibration)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--ckpt', type=str, required=True)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--key', type=str, default='g_ema', help='generator weights in the checkpoint')
+    parser.add_argument('--n_sample', type=int, default=256)
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--min_snr', type=float, default=30.0, help='keep convs below this many dB in float')
+    parser.add_argument('--fallback', type=str, nargs='*', default=[], help='layers to keep in float')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    checkpoint = torch.load(args.ckpt, map_location='cpu')
+    generator = load_model(
+        Generator,
+        unwrap_state_dict(checkpoint[args.key]),
+        args.size,
+        512,
+        8,
+        channel_multiplier=args.channel_multiplier,
+        strict=False,
+    )
+
+    calibration = calibrate(
+        generator,
+        n_samples=args.n_sample,
+        batch=args.batch,
+        fallback=args.fallback,
+        min_snr=args.min_snr,
+    )
+
+    for name, value in calibration['snr'].items():
+        state = 'float' if name in calibration['fallback'] else 'int8'
+        print(f'{name}: {value:.1f} dB, {state}')
+
+    torch.save(calibration, calibration_path(args.ckpt))
@@ -0,0 +1,33 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from export import export
+from model import Generator
+
+
+@pytest.fixture
+def generator():
+    torch.manual_seed(0)
+
+    return Generator(32, 32, 2, channel_multiplier=1).eval()
+
+
+@pytest.mark.parametrize('noise', ['buffers', 'input'])
+def test_torchscript_export_parity(generator, tmp_path, noise):
+    report = export(generator, str(tmp_path / 'generator.pt'), format='torchscript', noise=noise)
+
+    assert report['max_abs_error'] < 1e-4
+
+
+@pytest.mark.parametrize('noise', ['buffers', 'input'])
+def test_onnx_export_parity(generator, tmp_path, noise):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+
+    report = export(
+        generator, str(tmp_path / 'generator.onnx'), format='onnx', noise=noise, batch=2
+    )
+
+    assert report['max_abs_error'] < 1e-4
+    assert report['psnr'] > 80
@@ -0,0 +1,78 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from model import NoiseInjection
+from op import native
+
+
+def reference_layers(channel):
+    # StyledConv's NoiseInjection and FusedLeakyReLU with non-trivial parameters
+    noise_injection = NoiseInjection().double()
+    activate = native.FusedLeakyReLU(channel).double()
+
+    with torch.no_grad():
+        noise_injection.weight.fill_(0.7)
+        activate.bias.normal_()
+
+    return noise_injection, activate
+
+
+def tensors(noise_batch):
+    # input, noise, noise weight and bias, all float64 and requiring grad
+    torch.manual_seed(0)
+    noise_injection, activate = reference_layers(4)
+
+    return [
+        torch.randn(2, 4, 5, 5, dtype=torch.float64, requires_grad=True),
+        torch.randn(noise_batch, 1, 5, 5, dtype=torch.float64, requires_grad=True),
+        noise_injection.weight.detach().clone().requires_grad_(),
+        activate.bias.detach().clone().requires_grad_(),
+    ]
+
+
+@pytest.mark.parametrize('noise_batch', [1, 2])
+def test_fused_noise_leaky_relu_matches_layers(noise_batch):
+    input, noise, noise_weight, bias = tensors(noise_batch)
+    noise_injection, activate = reference_layers(4)
+
+    with torch.no_grad():
+        noise_injection.weight.copy_(noise_weight)
+        activate.bias.copy_(bias)
+
+    out = native.fused_noise_leaky_relu(input, noise, noise_weight, bias)
+    grad_output = torch.randn_like(out)
+    grads = torch.autograd.grad(out, [input, noise, noise_weight, bias], grad_output)
+
+    reference_inputs = [t.detach().clone().requires_grad_() for t in (input, noise)]
+    reference = activate(noise_injection(*reference_inputs))
+    reference_grads = torch.autograd.grad(
+        reference,
+        reference_inputs + [noise_injection.weight, activate.bias],
+        grad_output,
+    )
+
+    torch.testing.assert_close(out, reference)
+
+    for grad, reference_grad in zip(grads, reference_grads):
+        torch.testing.assert_close(grad, reference_grad)
+
+
+@pytest.mark.parametrize('noise_batch', [1, 2])
+def test_fused_noise_leaky_relu_gradients(noise_batch):
+    inputs = tuple(tensors(noise_batch))
+
+    assert torch.autograd.gradcheck(native.fused_noise_leaky_relu, inputs)
+    assert torch.autograd.gradgradcheck(native.fused_noise_leaky_relu, inputs)
+
+
+def test_inplace_matches_out_of_place():
+    input, noise, noise_weight, bias = [t.detach() for t in tensors(1)]
+    out = native.fused_noise_leaky_relu(input, noise, noise_weight, bias)
+
+    with torch.no_grad():
+        inplace_input = input.clone()
+        inplace = native.fused_noise_leaky_relu_(inplace_input, noise, noise_weight, bias)
+
+    assert inplace.data_ptr() == inplace_input.data_ptr()
+    torch.testing.assert_close(inplace, out)
@@ -0,0 +1,403 @@
+import copy
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from torch import nn
+
+from blocks import AdaptiveInstanceNorm2d, InstanceNorm2d
+from model import (
+    Blur,
+    ConvLayer,
+    Downsample,
+    EqualConv2d,
+    Generator,
+    ModulatedConv2d,
+    MultiGenerator,
+    Patch_Discriminator,
+    ResBlock,
+    Trans,
+    Upsample,
+    load_model,
+)
+
+
+# fp32 outputs of two computation orders of the same convolutions
+TOLERANCE = dict(rtol=1e-4, atol=1e-4)
+
+
+def fused_pair(cls, *args, **kwargs):
+    # cls(*args, **kwargs) without and with fused_upsample, holding the same weights
+    torch.manual_seed(0)
+    unfused = cls(*args, fused_upsample=False, **kwargs)
+    fused = cls(*args, fused_upsample=True, **kwargs)
+    fused.load_state_dict(unfused.state_dict())
+
+    return unfused, fused
+
+
+@pytest.mark.parametrize('modulation', ['grouped', 'input'])
+@pytest.mark.parametrize('demodulate', [True, False])
+def test_fused_upsample_conv_matches_unfused(modulation, demodulate):
+    unfused, fused = fused_pair(
+        ModulatedConv2d,
+        8,
+        6,
+        3,
+        16,
+        demodulate=demodulate,
+        upsample=True,
+        modulation=modulation,
+    )
+    assert fused.fused_upsample
+
+    input = torch.randn(2, 8, 5, 5)
+    style = torch.randn(2, 16)
+
+    with torch.no_grad():
+        torch.testing.assert_close(fused(input, style), unfused(input, style), **TOLERANCE)
+
+
+@pytest.mark.parametrize('modulation', ['grouped', 'input'])
+@pytest.mark.parametrize('demodulate', [True, False])
+def test_fused_upsample_generator_matches_unfused(modulation, demodulate):
+    unfused, fused = fused_pair(Generator, 32, 64, 2, modulation=modulation)
+
+    # the StyledConvs; the ToRGBs never demodulate
+    for generator in (unfused, fused):
+        for layer in [generator.conv1, *generator.convs]:
+            layer.conv.demodulate = demodulate
+
+    latent = torch.randn(2, 64)
+
+    with torch.no_grad():
+        image, _ = fused([latent], randomize_noise=False)
+        reference, _ = unfused([latent], randomize_noise=False)
+
+    torch.testing.assert_close(image, reference, **TOLERANCE)
+
+
+def test_layer_styles_match_per_layer_affines():
+    torch.manual_seed(0)
+    generator = Generator(64, 32, 2, channel_multiplier=1)
+    latent = torch.randn(3, generator.n_latent, 32)
+
+    with torch.no_grad():
+        styles = generator.layer_styles(latent)
+
+        for conv, row, style in zip(generator.style_convs(), generator.style_index, styles):
+            torch.testing.assert_close(style, conv.modulation(latent[:, row]))
+
+
+@pytest.mark.parametrize('tile_batch', [None, 1])
+def test_tiled_synthesis_matches_untiled(tile_batch):
+    torch.manual_seed(0)
+    generator = Generator(64, 32, 2, channel_multiplier=1)
+    latent = torch.randn(2, 32)
+
+    with torch.no_grad():
+        reference, _ = generator([latent], randomize_noise=False)
+        # the 32 and 64 px blocks on 16 px output tiles
+        image, _ = generator(
+            [latent], randomize_noise=False, tile_size=16, tile_from=16, tile_batch=tile_batch
+        )
+
+    torch.testing.assert_close(image, reference, rtol=1e-4, atol=1e-5)
+
+
+# the layers that run a conv, upfirdn2d or a norm; each one's output has to stay
+# channels_last
+LAYOUT_LAYERS = (
+    nn.Conv2d,
+    EqualConv2d,
+    ModulatedConv2d,
+    Blur,
+    Upsample,
+    Downsample,
+    InstanceNorm2d,
+    AdaptiveInstanceNorm2d,
+)
+
+
+def channels_last_outputs(model, *inputs, **kwargs):
+    # {layer name: whether its output is channels_last} over one forward
+    outputs = {}
+    handles = []
+
+    def hook(name):
+        def record(module, args, out):
+            outputs[name] = out.is_contiguous(memory_format=torch.channels_last)
+
+        return record
+
+    for name, module in model.named_modules():
+        if isinstance(module, LAYOUT_LAYERS):
+            handles.append(module.register_forward_hook(hook(name)))
+
+    try:
+        with torch.no_grad():
+            model(*inputs, **kwargs)
+
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    return outputs
+
+
+@pytest.mark.parametrize('modulation', ['auto', 'input'])
+def test_generator_stays_channels_last(modulation):
+    generator = Generator(32, 32, 2, modulation=modulation, channels_last=True)
+    outputs = channels_last_outputs(generator, [torch.randn(2, 32)])
+
+    assert outputs
+    assert [name for name, ok in outputs.items() if not ok] == []
+
+
+def test_patch_discriminator_stays_channels_last():
+    discriminator = Patch_Discriminator(32, channels_last=True)
+    outputs = channels_last_outputs(discriminator, torch.randn(4, 3, 32, 32), flag=0)
+
+    assert outputs
+    assert [name for name, ok in outputs.items() if not ok] == []
+
+
+def test_trans_stays_channels_last():
+    trans = Trans(num_filters=16, num_filters_mlp=32, channels_last=True)
+    outputs = channels_last_outputs(trans, torch.randn(3, 64, 64), torch.randn(3, 64, 64))
+
+    assert outputs
+    assert [name for name, ok in outputs.items() if not ok] == []
+
+
+@pytest.mark.parametrize(
+    'build, inputs, kwargs',
+    [
+        (
+            lambda: Generator(32, 32, 2, channel_multiplier=1),
+            lambda: ([torch.randn(2, 32)],),
+            dict(randomize_noise=False),
+        ),
+        (
+            lambda: Patch_Discriminator(32, channel_multiplier=1),
+            lambda: (torch.randn(4, 3, 32, 32),),
+            dict(flag=0),
+        ),
+        (
+            lambda: Trans(num_filters=16, num_filters_mlp=32),
+            lambda: (torch.randn(3, 64, 64), torch.randn(3, 64, 64)),
+            {},
+        ),
+    ],
+    ids=['Generator', 'Patch_Discriminator', 'Trans'],
+)
+def test_frozen_matches_unfrozen(build, inputs, kwargs):
+    torch.manual_seed(0)
+    model = build().eval()
+    frozen = copy.deepcopy(model).freeze_for_inference()
+    inputs = inputs()
+
+    with torch.no_grad():
+        reference = model(*inputs, **kwargs)
+        out = frozen(*inputs, **kwargs)
+
+    if isinstance(reference, tuple):
+        reference, out = reference[0], out[0]
+
+    torch.testing.assert_close(out, reference, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    'options',
+    [{}, dict(upsample=True), dict(downsample=True), dict(demodulate=False)],
+    ids=['plain', 'upsample', 'downsample', 'no_demodulate'],
+)
+def test_input_scaling_matches_grouped(options):
+    torch.manual_seed(0)
+    grouped = ModulatedConv2d(8, 6, 3, 16, modulation='grouped', **options)
+    scaling = copy.deepcopy(grouped)
+    scaling.modulation_mode = 'input'
+
+    input = torch.randn(3, 8, 8, 8)
+    style = torch.randn(3, 16)
+    grad_output = None
+    results = []
+
+    for conv in (grouped, scaling):
+        x = input.clone().requires_grad_()
+        s = style.clone().requires_grad_()
+        out = conv(x, s)
+
+        if grad_output is None:
+            grad_output = torch.randn_like(out)
+
+        out.backward(grad_output)
+        results.append(
+            [out, x.grad, s.grad, conv.weight.grad, conv.modulation.weight.grad]
+        )
+
+    for value, reference in zip(results[1], results[0]):
+        torch.testing.assert_close(value, reference, **TOLERANCE)
+
+
+@pytest.mark.parametrize('inject_index', [0, 1, 3, 'last', 'n_latent'])
+def test_style_mixing_matches_pairs(inject_index):
+    torch.manual_seed(0)
+    generator = Generator(32, 32, 2, channel_multiplier=1)
+    inject_index = {'last': generator.n_latent - 1, 'n_latent': generator.n_latent}.get(
+        inject_index, inject_index
+    )
+    coarse = torch.randn(2, 32)
+    fine = torch.randn(3, 32)
+
+    with torch.no_grad():
+        grid = generator.style_mixing(coarse, fine, inject_index, randomize_noise=False)
+
+        for n in range(2):
+            for m in range(3):
+                reference, _ = generator(
+                    [coarse[n : n + 1], fine[m : m + 1]],
+                    inject_index=inject_index,
+                    randomize_noise=False,
+                )
+                torch.testing.assert_close(grid[n, m], reference[0], **TOLERANCE)
+
+
+@pytest.mark.parametrize('shared_mapping', [False, True])
+def test_multi_generator_matches_each_generator(shared_mapping):
+    torch.manual_seed(0)
+    generators = [Generator(32, 32, 2, channel_multiplier=1) for _ in range(3)]
+
+    if shared_mapping:
+        # only the synthesis differs, as after an adaptation that froze the mapping
+        for generator in generators[1:]:
+            generator.style.load_state_dict(generators[0].style.state_dict())
+
+    multi = MultiGenerator(generators)
+    model = [0, 2, 1, 0, 2]
+    latent = torch.randn(len(model), 32)
+
+    with torch.no_grad():
+        images, _ = multi(latent, model, randomize_noise=False)
+
+        for i, k in enumerate(model):
+            reference, _ = generators[k]([latent[i : i + 1]], randomize_noise=False)
+            torch.testing.assert_close(images[i], reference[0], **TOLERANCE)
+
+
+@pytest.mark.parametrize('size', [8, 9])
+@pytest.mark.parametrize(
+    'build',
+    [
+        lambda fused: ConvLayer(4, 6, 3, downsample=True, fused_downsample=fused),
+        lambda fused: ConvLayer(
+            4, 6, 1, downsample=True, activate=False, bias=False, fused_downsample=fused
+        ),
+        lambda fused: ResBlock(4, 6, fused_downsample=fused),
+    ],
+    ids=['conv', 'skip', 'resblock'],
+)
+def test_fused_downsample_matches_unfused(build, size):
+    torch.manual_seed(0)
+    unfused = build(False)
+    fused = build(True)
+    fused.load_state_dict(unfused.state_dict())
+
+    input = torch.randn(2, 4, size, size)
+    outputs = []
+    grad_output = None
+
+    for layer in (unfused, fused):
+        x = input.clone().requires_grad_()
+        out = layer(x)
+
+        if grad_output is None:
+            grad_output = torch.randn_like(out)
+
+        out.backward(grad_output)
+        outputs.append((out, x.grad))
+
+    for value, reference in zip(outputs[1], outputs[0]):
+        torch.testing.assert_close(value, reference, **TOLERANCE)
+
+
+DEVICES = [
+    'cpu',
+    pytest.param(
+        'cuda',
+        marks=pytest.mark.skipif(not torch.cuda.is_available(), reason='needs CUDA'),
+    ),
+]
+
+
+def saved_generator(tmp_path):
+    # a Generator and its state_dict after a round trip through torch.save
+    torch.manual_seed(0)
+    generator = Generator(32, 32, 2, channel_multiplier=1)
+    torch.save(generator.state_dict(), tmp_path / 'generator.pt')
+
+    return generator, torch.load(tmp_path / 'generator.pt')
+
+
+def tensors(model):
+    return list(model.parameters()) + list(model.buffers())
+
+
+@pytest.mark.parametrize('device', DEVICES)
+@pytest.mark.parametrize('channels_last', [False, True])
+def test_load_model_round_trip(tmp_path, device, channels_last):
+    generator, state_dict = saved_generator(tmp_path)
+    loaded = load_model(
+        Generator,
+        state_dict,
+        32,
+        32,
+        2,
+        channel_multiplier=1,
+        device=device,
+        channels_last=channels_last,
+    )
+
+    assert all(tensor.device.type == device for tensor in tensors(loaded))
+    assert all(
+        tensor.is_contiguous(memory_format=torch.channels_last)
+        for tensor in tensors(loaded)
+        if channels_last and tensor.dim() == 4
+    )
+
+    latent = torch.randn(2, 32)
+
+    with torch.no_grad():
+        reference, _ = generator([latent], randomize_noise=False)
+        image, _ = loaded([latent.to(device)], randomize_noise=False)
+
+    torch.testing.assert_close(image.cpu(), reference, **TOLERANCE)
+
+
+def test_load_model_fills_missing_tensors(tmp_path):
+    _, state_dict = saved_generator(tmp_path)
+    missing = ['noises.noise_0', 'conv1.activate.bias', 'to_rgbs.0.conv.weight']
+
+    for name in missing:
+        del state_dict[name]
+
+    with pytest.raises(RuntimeError):
+        load_model(Generator, state_dict, 32, 32, 2, channel_multiplier=1)
+
+    loaded = load_model(Generator, state_dict, 32, 32, 2, channel_multiplier=1, strict=False)
+
+    assert not any(tensor.is_meta for tensor in tensors(loaded))
+
+    loaded_state = loaded.state_dict()
+
+    for name, value in state_dict.items():
+        torch.testing.assert_close(loaded_state[name], value)
+
+    for name in missing:
+        assert torch.isfinite(loaded_state[name]).all()
+
+    with torch.no_grad():
+        image, _ = loaded([torch.randn(2, 32)], randomize_noise=False)
+
+    assert torch.isfinite(image).all()
@@ -0,0 +1,60 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from op import native
+
+
+def reference(input, kernel, up, down, pad):
+    pad_x0, pad_x1, pad_y0, pad_y1 = pad
+
+    return native.upfirdn2d_native(
+        input, kernel, up, up, down, down, pad_x0, pad_x1, pad_y0, pad_y1
+    )
+
+
+@pytest.mark.parametrize('up', [2, 3, 4])
+@pytest.mark.parametrize('down', [1, 2])
+@pytest.mark.parametrize('kernel_size', [(3, 3), (4, 4), (5, 5), (5, 3)])
+@pytest.mark.parametrize(
+    'pad', [(1, 1, 1, 1), (2, 1, 2, 1), (0, 3, 2, 0), (-1, 2, 3, -2), (-2, -1, -1, 0)]
+)
+def test_polyphase_matches_reference(up, down, kernel_size, pad):
+    if min(kernel_size) < up:
+        pytest.skip('polyphase needs a kernel at least up taps long')
+
+    torch.manual_seed(0)
+    input = torch.randn(2, 3, 7, 6, dtype=torch.float64)
+    # not symmetric, so a missing or extra flip shows
+    kernel = torch.randn(*kernel_size, dtype=torch.float64)
+
+    plan = native.UpFirDn2dPlan(input, kernel, up, down, pad, mode='polyphase')
+
+    torch.testing.assert_close(plan(input), reference(input, kernel, up, down, pad))
+
+
+# (up, down, pad) of the Upsample, Downsample and Blur calls with a 4-tap kernel
+CONFIGS = {'up': (2, 1, (2, 1)), 'down': (1, 2, (1, 1)), 'blur': (1, 1, (2, 1))}
+
+
+@pytest.mark.parametrize('mode', ['direct', 'separable', 'polyphase'])
+@pytest.mark.parametrize('config', list(CONFIGS))
+def test_analytic_gradients(mode, config):
+    up, down, pad = CONFIGS[config]
+
+    if mode == 'polyphase' and up == 1:
+        pytest.skip('polyphase only applies to upsampling')
+
+    torch.manual_seed(0)
+    kernel_1d = torch.tensor([1.0, 2.0, 4.0, 3.0], dtype=torch.float64)
+    kernel_1d = kernel_1d / kernel_1d.sum()
+    kernel = torch.outer(kernel_1d, kernel_1d)
+    input = torch.randn(2, 3, 5, 6, dtype=torch.float64, requires_grad=True)
+
+    def fn(input):
+        return native.upfirdn2d(
+            input, kernel, up, down, pad, kernel_1d=kernel_1d, mode=mode
+        )
+
+    assert torch.autograd.gradcheck(fn, (input,))
+    assert torch.autograd.gradgradcheck(fn, (input,))
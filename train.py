@@ -29,7 +29,7 @@ except ImportError:
     wandb = None
 
 
-from model import Generator, Extra, Trans
+from model import Generator, Extra, Trans, load_model
 from model import Patch_Discriminator as Discriminator  # , Projection_head
 from dataset import MultiResolutionDataset
 from distributed import (
@@ -515,26 +515,68 @@ if __name__ == "__main__":
 
     args.start_iter = 0
 
-    generator = Generator(
-        args.size, args.latent, args.n_mlp, channel_multiplier=args.channel_multiplier
-    ).to(device)
-    g_source = Generator(
-        args.size, args.latent, args.n_mlp, channel_multiplier=args.channel_multiplier
-    ).to(device)
-    discriminator = Discriminator(
-        args.size, channel_multiplier=args.channel_multiplier
-    ).to(device)
-    d_source = Discriminator(
-        args.size, channel_multiplier=args.channel_multiplier
-    ).to(device)
-    g_ema = Generator(
-        args.size, args.latent, args.n_mlp, channel_multiplier=args.channel_multiplier
-    ).to(device)
+    if args.ckpt is not None:
+        print("load model:", args.ckpt)
+        # assert args.source_key in args.ckpt
+        ckpt = torch.load(args.ckpt, map_location=lambda storage, loc: storage)
+        ckpt_source = torch.load(args.ckpt, map_location=lambda storage, loc: storage)
+
+        try:
+            ckpt_name = os.path.basename(args.ckpt)
+            args.start_iter = int(os.path.splitext(ckpt_name)[0])
+
+        except ValueError:
+            pass
+
+        # built straight from the checkpoint tensors, without initialising the
+        # weights first; see load_model
+        generator_args = (args.size, args.latent, args.n_mlp)
+        generator = load_model(
+            Generator, ckpt["g"], *generator_args,
+            channel_multiplier=args.channel_multiplier, device=device, strict=False,
+        )
+        g_source = load_model(
+            Generator, ckpt_source["g"], *generator_args,
+            channel_multiplier=args.channel_multiplier, device=device, strict=False,
+        )
+        g_ema = load_model(
+            Generator, ckpt["g_ema"], *generator_args,
+            channel_multiplier=args.channel_multiplier, device=device, strict=False,
+        )
+
+        #d_source = nn.parallel.DataParallel(d_source)
+        #discriminator = nn.parallel.DataParallel(discriminator)
+        discriminator = load_model(
+            Discriminator, ckpt["d"], args.size,
+            channel_multiplier=args.channel_multiplier, device=device,
+        )
+        d_source = load_model(
+            Discriminator, ckpt_source["d"], args.size,
+            channel_multiplier=args.channel_multiplier, device=device,
+        )
+
+    else:
+        generator = Generator(
+            args.size, args.latent, args.n_mlp, channel_multiplier=args.channel_multiplier
+        ).to(device)
+        g_source = Generator(
+            args.size, args.latent, args.n_mlp, channel_multiplier=args.channel_multiplier
+        ).to(device)
+        discriminator = Discriminator(
+            args.size, channel_multiplier=args.channel_multiplier
+        ).to(device)
+        d_source = Discriminator(
+            args.size, channel_multiplier=args.channel_multiplier
+        ).to(device)
+        g_ema = Generator(
+            args.size, args.latent, args.n_mlp, channel_multiplier=args.channel_multiplier
+        ).to(device)
+        accumulate(g_ema, generator, 0)
+
     trans = Trans().to(device)  #downsample,resblocks,channels,filters
     extra = Extra().to(device)
 
     g_ema.eval()
-    accumulate(g_ema, generator, 0)
 
 
     g_reg_ratio = args.g_reg_every / (args.g_reg_every + 1)
@@ -568,28 +610,6 @@ if __name__ == "__main__":
                      'white_noise', 'hands', 'mountains', 'handsv2']
     
     if args.ckpt is not None:
-        print("load model:", args.ckpt)
-        # assert args.source_key in args.ckpt
-        ckpt = torch.load(args.ckpt, map_location=lambda storage, loc: storage)
-        ckpt_source = torch.load(args.ckpt, map_location=lambda storage, loc: storage)
-
-        try:
-            ckpt_name = os.path.basename(args.ckpt)
-            args.start_iter = int(os.path.splitext(ckpt_name)[0])
-
-        except ValueError:
-            pass
-
-
-        generator.load_state_dict(ckpt["g"], strict=False)
-        g_source.load_state_dict(ckpt_source["g"], strict=False)
-        g_ema.load_state_dict(ckpt["g_ema"], strict=False)
-
-        #d_source = nn.parallel.DataParallel(d_source)
-        #discriminator = nn.parallel.DataParallel(discriminator)
-        discriminator.load_state_dict(ckpt["d"])
-        d_source.load_state_dict(ckpt_source["d"])
-
         if 'g_optim' in ckpt.keys():
             g_optim.load_state_dict(ckpt["g_optim"])
         if 'd_optim' in ckpt.keys():